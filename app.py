@@ -1,9 +1,19 @@
 import streamlit as st
 import pandas as pd
 import sqlite3
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import time
 import io
+import os
+import re
+import math
+import csv
+import json
+import zipfile
+import tempfile
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import pytz
@@ -17,6 +27,52 @@ UBICACION = "Guadalajara, Jal."
 MONEDA = "$"
 TIMEOUT_SEGUNDOS = 3600
 LOGO_URL = "https://cdn-icons-png.flaticon.com/512/3500/3500833.png"
+DB_LOCAL = "inventario.db"
+HOJA_CALCULO = "PapeleriaDB"
+ZONA_HORARIA = pytz.timezone('America/Mexico_City')
+
+# Bandeja de salida hacia la nube (segundos)
+COLA_INTERVALO_SEGUNDOS = 5
+COLA_REINTENTO_BASE = 5
+COLA_REINTENTO_MAX = 300
+COLA_LOTE_MAX = 200
+
+# Exportación de ventas: filas leídas de SQLite por bloque
+EXPORTAR_BLOQUE = 5000
+
+# Inventario compartido: vigencia del catálogo local y cada cuánto se
+# pregunta a Drive si la hoja cambió (segundos)
+INVENTARIO_TTL_SEGUNDOS = 1800
+INVENTARIO_REVISION_SEGUNDOS = 120
+
+# Reabastecimiento: días de venta que se promedian, días que debe cubrir el
+# stock y días que tarda en llegar un pedido
+REORDEN_VENTANA_DIAS = 28
+REORDEN_COBERTURA_DIAS = 14
+REORDEN_PLAZO_DIAS = 3
+
+# Archivo histórico: los meses cerrados salen de inventario.db a un archivo
+# SQLite por mes. Se quedan en la base viva el mes en curso y el anterior.
+ARCHIVO_CARPETA = "archivo"
+ARCHIVO_MESES_VIVOS = 2
+
+# Encabezados de las pestañas de ventas por periodo (Ventas_AAAA_MM)
+ENCABEZADOS_VENTAS = ["Fecha", "Ticket", "Vendedor", "Total", "Resumen"]
+
+# Métricas de latencia (página Diagnóstico)
+METRICAS_ARCHIVO = "metricas.json"
+METRICAS_MUESTRAS = 500
+METRICAS_GUARDAR_SEGUNDOS = 60
+
+# Búsqueda por nombre en la caja
+BUSQUEDA_MAX_OPCIONES = 8
+
+# Inventario
+STOCK_BAJO = 5
+INVENTARIO_POR_PAGINA = 50
+
+# Importación masiva: rangos por cada batch_update a Google Sheets
+IMPORTAR_RANGOS_POR_LLAMADA = 500
 
 st.set_page_config(page_title=NOMBRE_NEGOCIO, layout="wide", page_icon="📒")
 
@@ -76,13 +132,19 @@ if 'usuario_actual' not in st.session_state:
 if 'rol_actual' not in st.session_state:
     st.session_state.rol_actual = None
 if 'carrito' not in st.session_state:
-    st.session_state.carrito = []
-if 'inventario_sincronizado' not in st.session_state:
-    st.session_state.inventario_sincronizado = False
+    st.session_state.carrito = {}  # codigo -> línea del ticket
+if 'carrito_total' not in st.session_state:
+    st.session_state.carrito_total = 0.0
+if 'opciones_busqueda' not in st.session_state:
+    st.session_state.opciones_busqueda = []
+if 'recepcion' not in st.session_state:
+    st.session_state.recepcion = {}  # codigo -> línea de la recepción
+if 'opciones_recepcion' not in st.session_state:
+    st.session_state.opciones_recepcion = []
+if 'resumen_recepcion' not in st.session_state:
+    st.session_state.resumen_recepcion = None
 if 'editando_id' not in st.session_state:
     st.session_state.editando_id = None
-if 'ultima_sinc' not in st.session_state:
-    st.session_state.ultima_sinc = "Pendiente"
 if 'last_active' not in st.session_state:
     st.session_state.last_active = time.time()
 
@@ -117,178 +179,1466 @@ def check_timeout():
 
 def hora_actual():
     """Devuelve la hora exacta de México"""
-    zona_mx = pytz.timezone('America/Mexico_City')
-    return datetime.now(zona_mx).strftime("%Y-%m-%d %H:%M:%S")
+    return datetime.now(ZONA_HORARIA).strftime("%Y-%m-%d %H:%M:%S")
+
+def fecha_hoy():
+    """Fecha de hoy en México (para los filtros de reportes)"""
+    return datetime.now(ZONA_HORARIA).date()
+
+def hora_de_epoch(ts):
+    """Epoch (segundos) -> 'AAAA-MM-DD HH:MM:SS' en hora de México"""
+    return datetime.fromtimestamp(ts, ZONA_HORARIA).strftime("%Y-%m-%d %H:%M:%S")
+
+def epoch_de_fecha(texto):
+    """'AAAA-MM-DD HH:MM:SS' en hora de México -> epoch; None si no se puede leer"""
+    try:
+        return int(ZONA_HORARIA.localize(datetime.strptime(str(texto)[:19], "%Y-%m-%d %H:%M:%S")).timestamp())
+    except ValueError:
+        return None
+
+def epoch_inicio_dia(dia):
+    """Epoch de las 00:00 (hora de México) del día dado"""
+    return int(ZONA_HORARIA.localize(datetime.combine(dia, datetime.min.time())).timestamp())
+
+def centavos(monto):
+    return int(round(monto * 100))
+
+# ==========================================
+# 4.1 MÉTRICAS (tiempos, llamadas y errores)
+# ==========================================
+# Cada llamada a Sheets, consulta SQL y sección de la interfaz guarda su
+# duración en un búfer circular por nombre. Los contadores se acumulan en
+# METRICAS_ARCHIVO para sobrevivir reinicios.
+
+@st.cache_resource
+def _metricas():
+    met = {'lock': threading.Lock(), 'muestras': {}, 'llamadas': defaultdict(int), 'errores': defaultdict(int),
+           'ultimos_errores': deque(maxlen=20), 'guardado': time.time()}
+    try:
+        with open(METRICAS_ARCHIVO) as f:
+            previo = json.load(f)
+        for nombre, datos in previo.get('metricas', {}).items():
+            met['llamadas'][nombre] = datos['llamadas']
+            met['errores'][nombre] = datos['errores']
+    except (OSError, ValueError, KeyError):
+        pass
+    return met
+
+def registrar_tiempo(nombre, segundos):
+    met = _metricas()
+    with met['lock']:
+        muestras = met['muestras'].get(nombre)
+        if muestras is None:
+            muestras = met['muestras'][nombre] = deque(maxlen=METRICAS_MUESTRAS)
+        muestras.append(segundos)
+        met['llamadas'][nombre] += 1
+
+def registrar_error(nombre, e):
+    met = _metricas()
+    with met['lock']:
+        met['errores'][nombre] += 1
+        met['ultimos_errores'].append((hora_actual(), nombre, f"{type(e).__name__}: {e}"))
+
+@contextmanager
+def medir(nombre):
+    """Mide el bloque; si lanza una excepción también la cuenta como error"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        registrar_error(nombre, e)
+        raise
+    finally:
+        registrar_tiempo(nombre, time.perf_counter() - inicio)
+
+def _percentil(ordenadas, p):
+    return ordenadas[min(len(ordenadas) - 1, int(p * len(ordenadas)))]
+
+def resumen_metricas():
+    """Filas [nombre, llamadas, errores, p50, p95, p99 (ms)] de todo lo medido"""
+    met = _metricas()
+    with met['lock']:
+        copia = {n: sorted(m) for n, m in met['muestras'].items()}
+        llamadas, errores = dict(met['llamadas']), dict(met['errores'])
+    filas = []
+    for nombre in sorted(set(llamadas) | set(errores)):
+        ordenadas = copia.get(nombre)
+        p50, p95, p99 = ([round(_percentil(ordenadas, p) * 1000, 2) for p in (0.50, 0.95, 0.99)]
+                         if ordenadas else [None] * 3)
+        filas.append([nombre, llamadas.get(nombre, 0), errores.get(nombre, 0), p50, p95, p99])
+    return filas
+
+def guardar_metricas(forzar=False):
+    """Vuelca el resumen al archivo local cada METRICAS_GUARDAR_SEGUNDOS"""
+    met = _metricas()
+    if not forzar and time.time() - met['guardado'] < METRICAS_GUARDAR_SEGUNDOS:
+        return
+    met['guardado'] = time.time()
+    datos = {'generado': hora_actual(),
+             'metricas': {f[0]: dict(zip(('llamadas', 'errores', 'p50_ms', 'p95_ms', 'p99_ms'), f[1:]))
+                          for f in resumen_metricas()}}
+    temporal = METRICAS_ARCHIVO + ".tmp"
+    with open(temporal, 'w') as f:
+        json.dump(datos, f, indent=1)
+    os.replace(temporal, METRICAS_ARCHIVO)
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor de SQLite que mide cada sentencia como sql.<VERBO> <tabla>.
+    Un SELECT cuenta desde el execute hasta la última fila leída (fetch*, iterar o
+    pd.read_sql): execute solo calcula la primera fila."""
+    _medicion = None  # [nombre, segundos] de la consulta cuyas filas siguen leyéndose
+
+    def _terminar_medicion(self):
+        if self._medicion is not None:
+            registrar_tiempo(*self._medicion)
+            self._medicion = None
+
+    def _medido(self, nombre, funcion, *args):
+        self._terminar_medicion()
+        inicio = time.perf_counter()
+        try:
+            resultado = funcion(*args)
+        except Exception as e:
+            registrar_error(nombre, e)
+            registrar_tiempo(nombre, time.perf_counter() - inicio)
+            raise
+        self._medicion = [nombre, time.perf_counter() - inicio]
+        if self.description is None:
+            self._terminar_medicion()
+        return resultado
+
+    def _leer(self, funcion, *args):
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args)
+        finally:
+            if self._medicion is not None:
+                self._medicion[1] += time.perf_counter() - inicio
+
+    def execute(self, sql, *args):
+        return self._medido(_nombre_sql(sql), super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._medido(_nombre_sql(sql), super().executemany, sql, *args)
+
+    def fetchone(self):
+        fila = self._leer(super().fetchone)
+        if fila is None:
+            self._terminar_medicion()
+        return fila
+
+    def fetchmany(self, *args, **kwargs):
+        filas = self._leer(super().fetchmany, *args, **kwargs)
+        if not filas:
+            self._terminar_medicion()
+        return filas
+
+    def fetchall(self):
+        filas = self._leer(super().fetchall)
+        self._terminar_medicion()
+        return filas
+
+    def __next__(self):
+        try:
+            return self._leer(super().__next__)
+        except StopIteration:
+            self._terminar_medicion()
+            raise
+
+    def close(self):
+        self._terminar_medicion()
+        super().close()
+
+    def __del__(self):
+        # fetchone() de una sola fila y cursores que nadie agota: se registra al soltarlos
+        self._terminar_medicion()
+
+class ConexionMedida(sqlite3.Connection):
+    """Conexión cuyos cursores (y atajos execute/executemany) pasan por CursorMedido"""
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+def _nombre_sql(sql):
+    verbo = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "?"
+    tabla = re.search(r"\b(?:FROM|INTO|UPDATE|TABLE|EXISTS)\s+(\w+)", sql, re.IGNORECASE)
+    return f"sql.{verbo} {tabla.group(1)}" if tabla else f"sql.{verbo}"
 
-def to_excel(df):
-    """Convierte Dataframe a Excel para descargar"""
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False)
-    return output.getvalue()
 
 # ==========================================
 # 5. BASE DE DATOS LOCAL (SQLite)
 # ==========================================
+# Modo WAL: los lectores no bloquean al escritor ni entre sí. Cada hilo
+# (cada ejecución de Streamlit y el hilo de la nube) lee con su propia
+# conexión; todas las escrituras pasan por una sola conexión con candado.
+PRAGMAS_SQLITE = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 30000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+)
+
+def _abrir_sqlite():
+    db = sqlite3.connect(DB_LOCAL, timeout=30, check_same_thread=False, isolation_level=None, factory=ConexionMedida)
+    for pragma in PRAGMAS_SQLITE:
+        db.execute(pragma)
+    return db
+
 @st.cache_resource
-def get_sql_connection():
-    return sqlite3.connect('inventario.db', check_same_thread=False)
+def _almacen_local():
+    return {'escritor': _abrir_sqlite(), 'candado': threading.Lock(), 'lectores': threading.local()}
 
+def lector():
+    """Conexión de lectura propia del hilo actual"""
+    lectores = _almacen_local()['lectores']
+    db = getattr(lectores, 'db', None)
+    if db is None:
+        db = lectores.db = _abrir_sqlite()
+    return db
+
+@contextmanager
+def transaccion(adjuntar=None):
+    """Escritura serializada y explícita: BEGIN IMMEDIATE ... COMMIT, o ROLLBACK si algo falla.
+    Con adjuntar (ruta), esa base queda unida como `archivo` mientras dura la transacción."""
+    almacen = _almacen_local()
+    with almacen['candado']:
+        db = almacen['escritor']
+        if adjuntar:
+            db.execute("ATTACH DATABASE ? AS archivo", (adjuntar,))
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db.cursor()
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            if adjuntar:
+                db.execute("DETACH DATABASE archivo")
+
+# Particiones por mes: cada mes cerrado vive en su propio archivo con las mismas
+# tablas ventas/detalle_ventas. Las consultas del historial corren en cada
+# archivo del rango (solo lectura) y al final en la base viva.
+def ruta_archivo(mes):
+    """Archivo de un mes cerrado ('AAAA-MM')"""
+    return os.path.join(ARCHIVO_CARPETA, f"ventas_{mes.replace('-', '_')}.db")
+
+def meses_archivados(desde=None, hasta=None):
+    """Meses 'AAAA-MM' ya archivados que se cruzan con el rango de días, del más viejo al más nuevo"""
+    try:
+        nombres = os.listdir(ARCHIVO_CARPETA)
+    except FileNotFoundError:
+        return []
+    meses = sorted(f"{m.group(1)}-{m.group(2)}" for m in (re.fullmatch(r"ventas_(\d{4})_(\d{2})\.db", n) for n in nombres) if m)
+    return [m for m in meses if (desde is None or m >= desde.isoformat()[:7]) and (hasta is None or m <= hasta.isoformat()[:7])]
+
+def particiones(desde=None, hasta=None, viva=None):
+    """Conexiones a recorrer para el rango: los archivos en orden y luego la base viva
+    (o `viva`, p. ej. el cursor de una transacción abierta)"""
+    for mes in meses_archivados(desde, hasta):
+        db = sqlite3.connect(f"file:{ruta_archivo(mes)}?mode=ro", uri=True, check_same_thread=False, factory=ConexionMedida)
+        try:
+            yield db
+        finally:
+            db.close()
+    yield viva if viva is not None else lector()
+
+# Versión del esquema (PRAGMA user_version). v1: ventas con epoch y centavos,
+# renglones ligados al producto por id y código de barras.
+ESQUEMA_VERSION = 1
+
+# ts = epoch UTC para rangos; fecha = hora local en texto para el ticket, la
+# hoja de Ventas y las llaves de los resúmenes. Importes en centavos enteros.
+TABLAS_VENTAS = {
+    'ventas': '''(
+                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                        ts INTEGER, 
+                        fecha TEXT, 
+                        total_centavos INTEGER, 
+                        vendedor TEXT)''',
+    'detalle_ventas': '''(
+                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                        venta_id INTEGER, 
+                        producto_id INTEGER, 
+                        codigo_barra TEXT, 
+                        producto_nombre TEXT, 
+                        cantidad INTEGER, 
+                        precio_centavos INTEGER, 
+                        subtotal_centavos INTEGER, 
+                        FOREIGN KEY(venta_id) REFERENCES ventas(id), 
+                        FOREIGN KEY(producto_id) REFERENCES productos(id))''',
+}
+
+def _migrar_ventas_v1(c):
+    """v0 -> v1: reescribe ventas/detalle con tipos nuevos. Los renglones viejos solo
+    traen el nombre; se ligan al producto actual con ese nombre (si existe)."""
+    c.connection.create_function("epoch_mx", 1, epoch_de_fecha, deterministic=True)
+    c.execute("CREATE TEMP TABLE mapa_nombres (nombre TEXT PRIMARY KEY, id INTEGER, codigo_barra TEXT)")
+    c.execute("INSERT OR IGNORE INTO mapa_nombres SELECT nombre, id, codigo_barra FROM productos ORDER BY id")
+    
+    c.execute(f"CREATE TABLE ventas_v1 {TABLAS_VENTAS['ventas']}")
+    c.execute('''INSERT INTO ventas_v1 (id, ts, fecha, total_centavos, vendedor)
+                 SELECT id, epoch_mx(fecha), fecha, CAST(round(total * 100) AS INTEGER), vendedor FROM ventas''')
+    c.execute(f"CREATE TABLE detalle_ventas_v1 {TABLAS_VENTAS['detalle_ventas']}")
+    c.execute('''INSERT INTO detalle_ventas_v1 (id, venta_id, producto_id, codigo_barra, producto_nombre, cantidad, 
+                                               precio_centavos, subtotal_centavos)
+                 SELECT d.id, d.venta_id, m.id, m.codigo_barra, d.producto_nombre, d.cantidad, 
+                        CAST(round(d.precio_unitario * 100) AS INTEGER), CAST(round(d.subtotal * 100) AS INTEGER)
+                 FROM detalle_ventas d LEFT JOIN mapa_nombres m ON m.nombre = d.producto_nombre''')
+    c.execute("DROP TABLE detalle_ventas")
+    c.execute("DROP TABLE ventas")
+    c.execute("ALTER TABLE ventas_v1 RENAME TO ventas")
+    c.execute("ALTER TABLE detalle_ventas_v1 RENAME TO detalle_ventas")
+    c.execute("DROP TABLE mapa_nombres")
+    
+    # Los resúmenes cambian a centavos y a código de barras; migrar_resumenes los vuelve a llenar
+    for tabla in ("resumen_ventas_hora", "resumen_ventas_dia", "resumen_productos", "resumen_sku_dia"):
+        c.execute(f"DROP TABLE IF EXISTS {tabla}")
+
+# Esquema y migraciones: una vez por proceso, no en cada ejecución de la página
+# (cada una tomaría el candado del escritor y haría esperar a las cajas)
+@st.cache_resource
 def init_local_db():
-    conn = get_sql_connection()
-    c = conn.cursor()
-    # Crear tablas si no existen
-    c.execute('''CREATE TABLE IF NOT EXISTS productos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                    codigo_barra TEXT UNIQUE, 
-                    nombre TEXT, 
-                    precio REAL, 
-                    stock INTEGER)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS usuarios (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                    nombre TEXT UNIQUE, 
-                    password TEXT, 
-                    rol TEXT)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS ventas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                    fecha TIMESTAMP, 
-                    total REAL, 
-                    vendedor TEXT)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS detalle_ventas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                    venta_id INTEGER, 
-                    producto_nombre TEXT, 
-                    cantidad INTEGER, 
-                    precio_unitario REAL, 
-                    subtotal REAL, 
-                    FOREIGN KEY(venta_id) REFERENCES ventas(id))''')
-    
-    # Crear usuario Admin por defecto si está vacío
-    c.execute('SELECT count(*) FROM usuarios')
-    if c.fetchone()[0] == 0:
-        if "general" in st.secrets and "admin_password" in st.secrets["general"]:
-            pass_admin = st.secrets["general"]["admin_password"]
-        else:
-            pass_admin = "admin123" 
+    with transaccion() as c:
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1 and c.execute("SELECT 1 FROM sqlite_master WHERE name = 'ventas'").fetchone():
+            _migrar_ventas_v1(c)
+        
+        # Crear tablas si no existen
+        c.execute('''CREATE TABLE IF NOT EXISTS productos (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                        codigo_barra TEXT UNIQUE, 
+                        nombre TEXT, 
+                        precio REAL, 
+                        stock INTEGER)''')
+    
+        c.execute('''CREATE TABLE IF NOT EXISTS usuarios (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                        nombre TEXT UNIQUE, 
+                        password TEXT, 
+                        rol TEXT)''')
+    
+        for tabla, columnas in TABLAS_VENTAS.items():
+            c.execute(f"CREATE TABLE IF NOT EXISTS {tabla} {columnas}")
+    
+        # Bandeja de salida: operaciones pendientes de subir a Google Sheets
+        c.execute('''CREATE TABLE IF NOT EXISTS cola_nube (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                        tipo TEXT, 
+                        datos TEXT, 
+                        creado TIMESTAMP, 
+                        intentos INTEGER DEFAULT 0, 
+                        proximo_intento REAL DEFAULT 0, 
+                        ultimo_error TEXT)''')
+    
+        # Bitácora de movimientos de stock (solo se agregan renglones, ver sección 5.2)
+        c.execute('''CREATE TABLE IF NOT EXISTS movimientos_stock (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                        codigo_barra TEXT, 
+                        delta INTEGER, 
+                        tipo TEXT, 
+                        referencia TEXT, 
+                        fecha TIMESTAMP, 
+                        enviado INTEGER DEFAULT 0)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_pendientes ON movimientos_stock(codigo_barra) WHERE enviado = 0")
+        # Ninguna consulta lo usaba y cada renglón vendido pagaba su mantenimiento
+        c.execute("DROP INDEX IF EXISTS idx_movimientos_codigo")
+        
+        # Bases anteriores a la bitácora: los descuentos que seguían en la cola pasan a movimientos
+        for cola_id, datos in c.execute("SELECT id, datos FROM cola_nube WHERE tipo = 'stock'").fetchall():
+            c.executemany('''INSERT INTO movimientos_stock (codigo_barra, delta, tipo, referencia, fecha) 
+                             VALUES (?, ?, 'venta', 'cola', ?)''',
+                          [(str(cod), -cant, hora_actual()) for cod, cant in json.loads(datos)['cambios']])
+            c.execute("DELETE FROM cola_nube WHERE id = ?", (cola_id,))
+    
+        # Resúmenes de ventas que se actualizan con cada cobro (ver sección 5.1)
+        c.execute('''CREATE TABLE IF NOT EXISTS resumen_ventas_hora (
+                        hora TEXT, 
+                        vendedor TEXT, 
+                        tickets INTEGER, 
+                        total_centavos INTEGER, 
+                        PRIMARY KEY (hora, vendedor))''')
+    
+        c.execute('''CREATE TABLE IF NOT EXISTS resumen_ventas_dia (
+                        dia TEXT, 
+                        vendedor TEXT, 
+                        tickets INTEGER, 
+                        total_centavos INTEGER, 
+                        PRIMARY KEY (dia, vendedor))''')
+    
+        # Por código de barras; los renglones sin código (productos ya borrados) se agrupan por nombre
+        c.execute('''CREATE TABLE IF NOT EXISTS resumen_productos (
+                        clave TEXT PRIMARY KEY, 
+                        codigo_barra TEXT, 
+                        producto_nombre TEXT, 
+                        cantidad INTEGER, 
+                        ingreso_centavos INTEGER)''')
+    
+        c.execute('''CREATE TABLE IF NOT EXISTS resumen_sku_dia (
+                        codigo_barra TEXT, 
+                        dia TEXT, 
+                        cantidad INTEGER, 
+                        PRIMARY KEY (codigo_barra, dia))''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_resumen_sku_dia_dia ON resumen_sku_dia(dia)")
+    
+        # Índices para reportes y detalle de tickets
+        c.execute("CREATE INDEX IF NOT EXISTS idx_detalle_ventas_venta ON detalle_ventas(venta_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_detalle_ventas_codigo ON detalle_ventas(codigo_barra)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ventas_ts ON ventas(ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ventas_vendedor_ts ON ventas(vendedor, ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_cola_nube_proximo ON cola_nube(proximo_intento)")
+    
+        # Índices para filtrar y ordenar el inventario
+        c.execute("CREATE INDEX IF NOT EXISTS idx_productos_nombre ON productos(nombre COLLATE NOCASE)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_productos_precio ON productos(precio)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_productos_stock ON productos(stock)")
+    
+        # Índice de texto completo sobre productos.nombre (sin acentos, por prefijo).
+        # Los triggers lo mantienen al día con cualquier alta, edición o baja.
+        nuevo_fts = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'productos_fts'").fetchone() is None
+        try:
+            c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5(
+                            nombre, content='productos', content_rowid='id', 
+                            tokenize="unicode61 remove_diacritics 2")''')
+            c.execute('''CREATE TRIGGER IF NOT EXISTS productos_fts_ai AFTER INSERT ON productos BEGIN
+                            INSERT INTO productos_fts(rowid, nombre) VALUES (new.id, new.nombre);
+                         END''')
+            c.execute('''CREATE TRIGGER IF NOT EXISTS productos_fts_ad AFTER DELETE ON productos BEGIN
+                            INSERT INTO productos_fts(productos_fts, rowid, nombre) VALUES ('delete', old.id, old.nombre);
+                         END''')
+            c.execute('''CREATE TRIGGER IF NOT EXISTS productos_fts_au AFTER UPDATE OF nombre ON productos BEGIN
+                            INSERT INTO productos_fts(productos_fts, rowid, nombre) VALUES ('delete', old.id, old.nombre);
+                            INSERT INTO productos_fts(rowid, nombre) VALUES (new.id, new.nombre);
+                         END''')
+            if nuevo_fts:
+                c.execute("INSERT INTO productos_fts(productos_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            # SQLite sin FTS5: la búsqueda usa LIKE
+            pass
+    
+        # Crear usuario Admin por defecto si está vacío
+        c.execute('SELECT count(*) FROM usuarios')
+        if c.fetchone()[0] == 0:
+            if "general" in st.secrets and "admin_password" in st.secrets["general"]:
+                pass_admin = st.secrets["general"]["admin_password"]
+            else:
+                pass_admin = "admin123" 
             
-        c.execute("INSERT INTO usuarios (nombre, password, rol) VALUES ('Admin', ?, 'Gerente')", (pass_admin,))
-        c.execute("INSERT INTO usuarios (nombre, password, rol) VALUES ('Cajero1', '1234', 'Empleado')")
-    conn.commit()
+            c.execute("INSERT INTO usuarios (nombre, password, rol) VALUES ('Admin', ?, 'Gerente')", (pass_admin,))
+            c.execute("INSERT INTO usuarios (nombre, password, rol) VALUES ('Cajero1', '1234', 'Empleado')")
+        
+        if version < ESQUEMA_VERSION:
+            c.execute(f"PRAGMA user_version = {ESQUEMA_VERSION}")
 
 init_local_db()
-conn = get_sql_connection()
+FTS_DISPONIBLE = lector().execute("SELECT 1 FROM sqlite_master WHERE name = 'productos_fts'").fetchone() is not None
+
+# ==========================================
+# 5.1 RESÚMENES DE VENTAS (Reportes)
+# ==========================================
+# Totales por hora, por día y por producto. Se suman dentro de la misma
+# transacción del cobro, así Reportes lee unas cuantas filas en lugar de
+# todo el historial. Siempre se pueden recalcular desde ventas/detalle.
+
+# Cada resumen: (consulta que lo agrega desde ventas/detalle, UPSERT que lo suma)
+RESUMENES = {
+    'resumen_ventas_hora': (
+        "SELECT substr(fecha, 1, 13), vendedor, count(*), sum(total_centavos) FROM ventas GROUP BY 1, 2",
+        '''INSERT INTO resumen_ventas_hora (hora, vendedor, tickets, total_centavos) VALUES (?, ?, ?, ?)
+           ON CONFLICT (hora, vendedor) DO UPDATE SET 
+               tickets = tickets + excluded.tickets, total_centavos = total_centavos + excluded.total_centavos'''),
+    'resumen_ventas_dia': (
+        "SELECT substr(fecha, 1, 10), vendedor, count(*), sum(total_centavos) FROM ventas GROUP BY 1, 2",
+        '''INSERT INTO resumen_ventas_dia (dia, vendedor, tickets, total_centavos) VALUES (?, ?, ?, ?)
+           ON CONFLICT (dia, vendedor) DO UPDATE SET 
+               tickets = tickets + excluded.tickets, total_centavos = total_centavos + excluded.total_centavos'''),
+    # El nombre que queda es el del renglón más reciente de cada producto
+    'resumen_productos': (
+        '''SELECT clave, codigo_barra, producto_nombre, cantidad, ingreso FROM (
+               SELECT coalesce(codigo_barra, producto_nombre) AS clave, codigo_barra, producto_nombre, 
+                      sum(cantidad) AS cantidad, sum(subtotal_centavos) AS ingreso, max(id) 
+               FROM detalle_ventas GROUP BY 1)''',
+        '''INSERT INTO resumen_productos (clave, codigo_barra, producto_nombre, cantidad, ingreso_centavos) 
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT (clave) DO UPDATE SET producto_nombre = excluded.producto_nombre, 
+               cantidad = cantidad + excluded.cantidad, ingreso_centavos = ingreso_centavos + excluded.ingreso_centavos'''),
+    'resumen_sku_dia': (
+        '''SELECT d.codigo_barra, substr(v.fecha, 1, 10), sum(d.cantidad) 
+           FROM detalle_ventas d JOIN ventas v ON v.id = d.venta_id 
+           WHERE d.codigo_barra IS NOT NULL GROUP BY 1, 2''',
+        '''INSERT INTO resumen_sku_dia (codigo_barra, dia, cantidad) VALUES (?, ?, ?)
+           ON CONFLICT (codigo_barra, dia) DO UPDATE SET cantidad = cantidad + excluded.cantidad'''),
+}
+
+def sumar_venta_resumenes(c, fecha, vendedor, total_centavos, lineas):
+    """Suma un ticket a los resúmenes; lineas = [(codigo, nombre, cantidad, subtotal_centavos)]"""
+    c.execute(RESUMENES['resumen_ventas_hora'][1], (fecha[:13], vendedor, 1, total_centavos))
+    c.execute(RESUMENES['resumen_ventas_dia'][1], (fecha[:10], vendedor, 1, total_centavos))
+    c.executemany(RESUMENES['resumen_productos'][1], [(cod, cod, nombre, cant, sub) for cod, nombre, cant, sub in lineas])
+    c.executemany(RESUMENES['resumen_sku_dia'][1], [(cod, fecha[:10], cant) for cod, _, cant, _ in lineas])
+
+def reconstruir_resumenes(c):
+    """Recalcula todos los resúmenes desde las ventas, incluidos los meses archivados"""
+    for tabla in RESUMENES:
+        c.execute(f"DELETE FROM {tabla}")
+    # Archivos del más viejo al más nuevo y al final la base viva (vista desde esta transacción)
+    for fuente in particiones(viva=c):
+        for consulta, upsert in RESUMENES.values():
+            c.executemany(upsert, fuente.execute(consulta).fetchall())
+
+@st.cache_resource
+def migrar_resumenes():
+    """Bases creadas antes de los resúmenes: se llenan una vez con el historial"""
+    pendiente = lector().execute('''SELECT NOT EXISTS (SELECT 1 FROM resumen_ventas_dia) 
+                                           AND EXISTS (SELECT 1 FROM ventas)''').fetchone()[0]
+    if pendiente:
+        with transaccion() as c:
+            reconstruir_resumenes(c)
+
+migrar_resumenes()
+
+def filtro_ventas(desde, hasta, vendedor, columna='ts', prefijo=''):
+    """Arma el WHERE de un rango de días [desde, hasta] y cajero opcional.
+    Sobre ventas compara el epoch (ts); en los resúmenes, la llave dia/hora en texto."""
+    limite = epoch_inicio_dia if columna == 'ts' else date.isoformat
+    condiciones, params = [], []
+    if desde:
+        condiciones.append(f"{prefijo}{columna} >= ?")
+        params.append(limite(desde))
+    if hasta:
+        condiciones.append(f"{prefijo}{columna} < ?")
+        params.append(limite(hasta + timedelta(days=1)))
+    if vendedor:
+        condiciones.append(f"{prefijo}vendedor = ?")
+        params.append(vendedor)
+    return (" WHERE " + " AND ".join(condiciones)) if condiciones else "", params
+
+def version_reporte(desde, hasta, vendedor):
+    """Último ticket dentro del filtro: solo cambia si entra una venta a ese rango"""
+    where, params = filtro_ventas(desde, hasta, vendedor)
+    return lector().execute(f"SELECT max(id) FROM ventas{where}", params).fetchone()[0]
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def consultar_reporte(desde, hasta, vendedor, version):
+    """KPIs, top de productos y ventas por hora del filtro (cacheado por versión)"""
+    db = lector()
+    where, params = filtro_ventas(desde, hasta, vendedor, columna='dia')
+    tickets, total = db.execute(f"SELECT coalesce(sum(tickets), 0), coalesce(sum(total_centavos), 0) / 100.0 "
+                                f"FROM resumen_ventas_dia{where}", params).fetchone()
+    
+    where, params = filtro_ventas(desde, hasta, vendedor, columna='hora')
+    por_hora = pd.read_sql(f'''SELECT CAST(substr(hora, 12, 2) AS INTEGER) AS hora, sum(total_centavos) / 100.0 AS total 
+                               FROM resumen_ventas_hora{where} GROUP BY 1 ORDER BY 1''', db, params=params, index_col='hora')
+    
+    if desde is None and hasta is None and vendedor is None:
+        top = pd.read_sql('''SELECT coalesce(p.nombre, r.producto_nombre) AS producto_nombre, r.cantidad 
+                             FROM resumen_productos r LEFT JOIN productos p ON p.codigo_barra = r.codigo_barra 
+                             ORDER BY r.cantidad DESC LIMIT 5''', db, index_col='producto_nombre')
+    else:
+        # El resumen por producto es histórico; con filtro se agrega el detalle del rango,
+        # mes archivado por mes archivado, y se junta aquí
+        where, params = filtro_ventas(desde, hasta, vendedor, prefijo='v.')
+        partes = [pd.read_sql(f'''SELECT coalesce(d.codigo_barra, d.producto_nombre) AS clave, d.codigo_barra, 
+                                         max(d.producto_nombre) AS producto_nombre, sum(d.cantidad) AS cantidad 
+                                  FROM ventas v JOIN detalle_ventas d ON d.venta_id = v.id{where} GROUP BY 1''',
+                              fuente, params=params) for fuente in particiones(desde, hasta)]
+        # Una partición sin ventas en el rango llega sin tipos (object); se descarta
+        partes = [p for p in partes if not p.empty]
+        if not partes:
+            return {'tickets': tickets, 'total': total, 'por_hora': por_hora,
+                    'top': pd.DataFrame({'cantidad': pd.Series(dtype='int64')}, index=pd.Index([], name='producto_nombre'))}
+        top = (pd.concat(partes).astype({'cantidad': 'int64'}).groupby('clave')
+               .agg(codigo_barra=('codigo_barra', 'last'), producto_nombre=('producto_nombre', 'last'), cantidad=('cantidad', 'sum'))
+               .nlargest(5, 'cantidad'))
+        codigos = top['codigo_barra'].dropna().tolist()
+        actuales = dict(db.execute(f"SELECT codigo_barra, nombre FROM productos WHERE codigo_barra IN ({','.join('?' * len(codigos))})",
+                                   codigos)) if codigos else {}
+        top['producto_nombre'] = top['codigo_barra'].map(actuales).fillna(top['producto_nombre'])
+        top = top.set_index('producto_nombre')[['cantidad']]
+    return {'tickets': tickets, 'total': total, 'top': top, 'por_hora': por_hora}
+
+# ==========================================
+# 5.2 MOVIMIENTOS DE STOCK (bitácora)
+# ==========================================
+# Cada venta, recepción o ajuste agrega un renglón con su delta. productos.stock
+# es la foto actual: lo último que dijo la nube más los movimientos que aún
+# no se suben (enviado = 0). A la nube se mandan deltas, nunca valores
+# absolutos, para que varias terminales puedan vender el mismo producto.
+# Los ya subidos de meses cerrados se podan al archivar (5.7).
+
+def registrar_movimientos(c, tipo, referencia, cambios, enviado=0, sin_negativos=False):
+    """Agrega movimientos [(codigo, delta)] y los aplica al stock local en la transacción en curso.
+    Con sin_negativos, si algún producto quedaría abajo de cero (o ya no existe) lanza ValueError
+    y quien abrió la transacción la revierte completa."""
+    if sin_negativos:
+        c.execute("SAVEPOINT descuento")
+        c.executemany("UPDATE productos SET stock = stock + ? WHERE codigo_barra = ? AND stock + ? >= 0",
+                      [(delta, cod, delta) for cod, delta in cambios])
+        if c.rowcount != len(cambios):
+            # executemany suma las filas tocadas: faltó al menos una. Se deshace el
+            # descuento parcial para reportar exactamente cuáles no alcanzan.
+            c.execute("ROLLBACK TO descuento")
+            existentes = dict(c.execute(f"SELECT codigo_barra, stock FROM productos WHERE codigo_barra IN "
+                                        f"({','.join('?' * len(cambios))})", [cod for cod, _ in cambios]))
+            faltantes = [f"{cod} (quedan {existentes[cod]})" if cod in existentes else f"{cod} (ya no existe)"
+                         for cod, delta in cambios if cod not in existentes or existentes[cod] + delta < 0]
+            raise ValueError("Stock insuficiente: " + ", ".join(faltantes))
+        c.execute("RELEASE descuento")
+    else:
+        c.executemany("UPDATE productos SET stock = stock + ? WHERE codigo_barra = ?", [(delta, cod) for cod, delta in cambios])
+    fecha = hora_actual()
+    c.executemany('''INSERT INTO movimientos_stock (codigo_barra, delta, tipo, referencia, fecha, enviado) 
+                     VALUES (?, ?, ?, ?, ?, ?)''', [(cod, delta, tipo, referencia, fecha, enviado) for cod, delta in cambios])
+
+def stock_pendiente(c):
+    """Suma por código de los movimientos que la nube todavía no tiene"""
+    return dict(c.execute("SELECT codigo_barra, sum(delta) FROM movimientos_stock WHERE enviado = 0 GROUP BY 1"))
+
+# ==========================================
+# 5.3 EXPORTACIÓN DE VENTAS (Excel / CSV / Parquet)
+# ==========================================
+# Se lee SQLite por bloques y se escribe directo a un archivo temporal,
+# así la memoria no crece con el tamaño del historial.
+
+def consultas_exportacion(desde, hasta, vendedor):
+    """SQL de ventas y de su detalle para el filtro del reporte"""
+    where, params = filtro_ventas(desde, hasta, vendedor)
+    where_d, params_d = filtro_ventas(desde, hasta, vendedor, prefijo='v.')
+    return {
+        'ventas': (f"SELECT id, fecha, total_centavos / 100.0 AS total, vendedor FROM ventas{where} ORDER BY id", params, desde, hasta),
+        'detalle': (f'''SELECT d.venta_id, v.fecha, v.vendedor, d.codigo_barra, d.producto_nombre, d.cantidad, 
+                               d.precio_centavos / 100.0 AS precio_unitario, d.subtotal_centavos / 100.0 AS subtotal 
+                        FROM ventas v JOIN detalle_ventas d ON d.venta_id = v.id{where_d} ORDER BY d.venta_id, d.id''', params_d, 
+                    desde, hasta),
+    }
+
+def leer_por_bloques(sql, params, desde=None, hasta=None):
+    """Devuelve las columnas y un generador de bloques de filas (meses archivados del rango y luego la base viva)"""
+    columnas = [d[0] for d in lector().execute(f"SELECT * FROM ({sql}) LIMIT 0", params).description]
+    def bloques():
+        for fuente in particiones(desde, hasta):
+            cur = fuente.execute(sql, params)
+            while True:
+                filas = cur.fetchmany(EXPORTAR_BLOQUE)
+                if not filas:
+                    break
+                yield filas
+    return columnas, bloques()
+
+def _exportar_excel(consultas, ruta):
+    from openpyxl import Workbook
+    libro = Workbook(write_only=True)
+    for nombre, consulta in consultas.items():
+        hoja = libro.create_sheet(nombre.capitalize())
+        columnas, bloques = leer_por_bloques(*consulta)
+        hoja.append(columnas)
+        for filas in bloques:
+            for fila in filas:
+                hoja.append(fila)
+    libro.save(ruta)
+
+def _exportar_csv(consultas, ruta):
+    with zipfile.ZipFile(ruta, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for nombre, consulta in consultas.items():
+            with zf.open(f"{nombre}.csv", 'w') as crudo, io.TextIOWrapper(crudo, encoding='utf-8-sig', newline='') as texto:
+                escritor = csv.writer(texto)
+                columnas, bloques = leer_por_bloques(*consulta)
+                escritor.writerow(columnas)
+                for filas in bloques:
+                    escritor.writerows(filas)
+
+def _exportar_parquet(consultas, ruta):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    # Esquema fijo: un bloque con una columna toda NULL (códigos de renglones viejos)
+    # no debe decidir el tipo de los siguientes
+    tipos = {'id': pa.int64(), 'venta_id': pa.int64(), 'cantidad': pa.int64(),
+             'total': pa.float64(), 'precio_unitario': pa.float64(), 'subtotal': pa.float64()}
+    carpeta = os.path.dirname(ruta)
+    with zipfile.ZipFile(ruta, 'w') as zf:
+        for nombre, consulta in consultas.items():
+            parte = os.path.join(carpeta, f"{nombre}.parquet")
+            columnas, bloques = leer_por_bloques(*consulta)
+            esquema = pa.schema([(c, tipos.get(c, pa.string())) for c in columnas])
+            with pq.ParquetWriter(parte, esquema) as escritor:
+                for filas in bloques:
+                    escritor.write_table(pa.Table.from_pylist([dict(zip(columnas, f)) for f in filas], schema=esquema))
+            zf.write(parte, f"{nombre}.parquet")
+
+FORMATOS_EXPORTACION = {
+    "Excel": (_exportar_excel, "xlsx"),
+    "CSV": (_exportar_csv, "zip"),
+    "Parquet": (_exportar_parquet, "zip"),
+}
+
+def exportar_ventas(formato, carpeta, desde, hasta, vendedor):
+    """Escribe ventas y detalle del filtro en la carpeta dada; devuelve la ruta del archivo"""
+    funcion, extension = FORMATOS_EXPORTACION[formato]
+    sufijo = "_".join(x.isoformat() for x in (desde, hasta) if x) or "completo"
+    ruta = os.path.join(carpeta, f"reporte_ventas_{sufijo}.{extension}")
+    funcion(consultas_exportacion(desde, hasta, vendedor), ruta)
+    return ruta
+
+# ==========================================
+# 5.4 ÍNDICE EN MEMORIA (Productos por código)
+# ==========================================
+# El escáner consulta este diccionario en lugar de SQLite. Es uno solo por
+# proceso; se recarga tras sincronizar y se parcha con cada venta local.
+# Su versión sube con cada cambio a productos y sirve de llave de caché.
+class ProductoIdx:
+    __slots__ = ('id', 'codigo', 'nombre', 'precio', 'stock')
+
+    def __init__(self, id, codigo, nombre, precio, stock):
+        self.id = id
+        self.codigo = codigo
+        self.nombre = nombre
+        self.precio = precio
+        self.stock = stock
+
+@st.cache_resource
+def _indice_productos():
+    return {'lock': threading.Lock(), 'por_codigo': None, 'version': 0}
+
+def version_productos():
+    return _indice_productos()['version']
+
+def recargar_indice_productos():
+    """Vuelve a armar el índice desde SQLite"""
+    filas = lector().execute("SELECT id, codigo_barra, nombre, precio, stock FROM productos").fetchall()
+    nuevo = {f[1]: ProductoIdx(*f) for f in filas}
+    idx = _indice_productos()
+    with idx['lock']:
+        idx['por_codigo'] = nuevo
+        idx['version'] += 1
+
+def buscar_producto_codigo(codigo):
+    """Búsqueda exacta por código de barras, sin tocar la base"""
+    idx = _indice_productos()
+    if idx['por_codigo'] is None:
+        recargar_indice_productos()
+    return idx['por_codigo'].get(codigo)
+
+def buscar_productos_nombre(texto, limite=BUSQUEDA_MAX_OPCIONES):
+    """Productos cuyo nombre coincide, del más al menos relevante"""
+    columnas = "p.id, p.codigo_barra, p.nombre, p.precio, p.stock"
+    terminos = re.findall(r"\w+", texto)
+    if FTS_DISPONIBLE and terminos:
+        # Cada palabra se busca como prefijo: "lap azu" encuentra "Lápiz Azul"
+        consulta = " ".join(f'"{t}"*' for t in terminos)
+        filas = lector().execute(f"""SELECT {columnas} FROM productos_fts f JOIN productos p ON p.id = f.rowid 
+                                WHERE productos_fts MATCH ? ORDER BY f.rank LIMIT ?""", (consulta, limite)).fetchall()
+    else:
+        filas = lector().execute(f"SELECT {columnas} FROM productos p WHERE p.nombre LIKE ? LIMIT ?",
+                             (f"%{texto}%", limite)).fetchall()
+    return [ProductoIdx(*f) for f in filas]
+
+def mover_indice_productos(cambios):
+    """Aplica al índice los deltas de stock [(codigo, delta)] ya guardados en SQLite"""
+    idx = _indice_productos()
+    with idx['lock']:
+        idx['version'] += 1
+        if idx['por_codigo'] is None:
+            return
+        for cod, delta in cambios:
+            prod = idx['por_codigo'].get(cod)
+            if prod is not None:
+                prod.stock += delta
+
+def fijar_indice_producto(codigo, fila):
+    """Refleja en el índice un alta, edición (fila = tupla de SQLite) o baja (fila = None)"""
+    idx = _indice_productos()
+    with idx['lock']:
+        idx['version'] += 1
+        if idx['por_codigo'] is None:
+            return
+        if fila is None:
+            idx['por_codigo'].pop(codigo, None)
+        else:
+            idx['por_codigo'][codigo] = ProductoIdx(*fila)
+
+# ==========================================
+# 5.5 INVENTARIO PAGINADO
+# ==========================================
+ORDENES_INVENTARIO = {
+    "Nombre (A-Z)": "nombre COLLATE NOCASE ASC",
+    "Código": "codigo_barra ASC",
+    "Precio (menor a mayor)": "precio ASC",
+    "Precio (mayor a menor)": "precio DESC",
+    "Stock (menor a mayor)": "stock ASC",
+}
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def consultar_inventario(texto, stock_bajo, precio_min, precio_max, orden, pagina, version):
+    """Una página del catálogo filtrada y ordenada en SQL; devuelve (total, DataFrame)"""
+    condiciones, params = [], []
+    if texto:
+        condiciones.append("(codigo_barra LIKE ? OR nombre LIKE ?)")
+        params += [f"{texto}%", f"%{texto}%"]
+    if stock_bajo:
+        condiciones.append("stock < ?")
+        params.append(STOCK_BAJO)
+    if precio_min:
+        condiciones.append("precio >= ?")
+        params.append(precio_min)
+    if precio_max:
+        condiciones.append("precio <= ?")
+        params.append(precio_max)
+    where = (" WHERE " + " AND ".join(condiciones)) if condiciones else ""
+    
+    db = lector()
+    total = db.execute(f"SELECT count(*) FROM productos{where}", params).fetchone()[0]
+    df = pd.read_sql(f'''SELECT id, codigo_barra, nombre, precio, stock FROM productos{where} 
+                         ORDER BY {ORDENES_INVENTARIO[orden]}, id LIMIT ? OFFSET ?''', db,
+                     params=params + [INVENTARIO_POR_PAGINA, pagina * INVENTARIO_POR_PAGINA])
+    return total, df
+
+
+# ==========================================
+# 5.6 REABASTECIMIENTO
+# ==========================================
+@st.cache_data(max_entries=16, show_spinner=False)
+def consultar_reorden(hoy, ventana, cobertura, plazo, version):
+    """Velocidad de venta, días de cobertura y cantidad sugerida de todo el catálogo en una pasada"""
+    db = lector()
+    productos = pd.read_sql("SELECT codigo_barra, nombre, stock FROM productos", db, index_col='codigo_barra')
+    vendidos = pd.read_sql('''SELECT codigo_barra, sum(cantidad) AS vendidos FROM resumen_sku_dia 
+                              WHERE dia > ? GROUP BY 1''', db, params=[(hoy - timedelta(days=ventana)).isoformat()],
+                           index_col='codigo_barra')
+    # Sin ventas en la ventana read_sql no trae tipos (object): se fija float
+    df = productos.join(vendidos, how='left').fillna({'vendidos': 0}).astype({'vendidos': 'float64'})
+    df['por_dia'] = df['vendidos'] / ventana
+    # Sin ventas en la ventana no hay cobertura que calcular (NaN)
+    df['dias_cobertura'] = (df['stock'].clip(lower=0) / df['por_dia']).where(df['por_dia'] > 0).round(1)
+    faltante = (df['por_dia'] * (cobertura + plazo) - df['stock']).clip(lower=0)
+    df['sugerido'] = (-(-faltante // 1)).astype(int)  # techo, sin salir de pandas
+    df['en_riesgo'] = df['dias_cobertura'] < cobertura + plazo
+    return df.sort_values(['dias_cobertura', 'por_dia'], ascending=[True, False], na_position='last').reset_index()
+
+# ==========================================
+# 5.7 ARCHIVO HISTÓRICO (un archivo por mes cerrado)
+# ==========================================
+# Los resúmenes no se tocan: ya contienen los meses archivados. Reportes,
+# exportación y reconstrucción recorren los archivos con particiones().
+
+def inicio_base_viva():
+    """Primer día del mes más viejo que se queda en inventario.db"""
+    limite = fecha_hoy().replace(day=1)
+    for _ in range(ARCHIVO_MESES_VIVOS - 1):
+        limite = (limite - timedelta(days=1)).replace(day=1)
+    return limite
+
+def meses_por_archivar():
+    """Primer día de cada mes cerrado que todavía tiene ventas en la base viva"""
+    limite = inicio_base_viva()
+    primera = lector().execute("SELECT min(ts) FROM ventas").fetchone()[0]
+    if primera is None:
+        return []
+    mes, meses = datetime.fromtimestamp(primera, ZONA_HORARIA).date().replace(day=1), []
+    while mes < limite:
+        meses.append(mes)
+        mes = (mes + timedelta(days=32)).replace(day=1)
+    return meses
+
+def archivar_mes(mes):
+    """Mueve ventas y detalle del mes (día 1) a su archivo; devuelve cuántas ventas movió.
+    Con WAL el COMMIT no es atómico entre dos archivos, así que son dos transacciones:
+    primero la copia al archivo (INSERT OR REPLACE, repetible) y, ya confirmada y contada,
+    el borrado en la base viva. Un corte entre ambas solo deja el mes para el siguiente intento."""
+    rango = (epoch_inicio_dia(mes), epoch_inicio_dia((mes + timedelta(days=32)).replace(day=1)))
+    if not lector().execute("SELECT EXISTS (SELECT 1 FROM ventas WHERE ts >= ? AND ts < ?)", rango).fetchone()[0]:
+        return 0
+    os.makedirs(ARCHIVO_CARPETA, exist_ok=True)
+    ruta = ruta_archivo(mes.isoformat()[:7])
+    with transaccion(adjuntar=ruta) as c:
+        for tabla, columnas in TABLAS_VENTAS.items():
+            c.execute(f"CREATE TABLE IF NOT EXISTS archivo.{tabla} {columnas}")
+        c.execute("CREATE INDEX IF NOT EXISTS archivo.idx_ventas_ts ON ventas(ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS archivo.idx_detalle_ventas_venta ON detalle_ventas(venta_id)")
+        c.execute("INSERT OR REPLACE INTO archivo.ventas SELECT * FROM main.ventas WHERE ts >= ? AND ts < ?", rango)
+        c.execute('''INSERT OR REPLACE INTO archivo.detalle_ventas 
+                     SELECT d.* FROM main.detalle_ventas d JOIN main.ventas v ON v.id = d.venta_id 
+                     WHERE v.ts >= ? AND v.ts < ?''', rango)
+    
+    with transaccion(adjuntar=ruta) as c:
+        # Solo se borra de la base viva si cada renglón del mes ya está en el archivo
+        faltan = c.execute('''SELECT (SELECT count(*) FROM main.ventas WHERE ts >= ? AND ts < ? 
+                                      AND id NOT IN (SELECT id FROM archivo.ventas))
+                                   + (SELECT count(*) FROM main.detalle_ventas d JOIN main.ventas v ON v.id = d.venta_id 
+                                      WHERE v.ts >= ? AND v.ts < ? AND d.id NOT IN (SELECT id FROM archivo.detalle_ventas))''',
+                           rango + rango).fetchone()[0]
+        if faltan:
+            raise RuntimeError(f"{ruta} incompleto ({faltan} renglones sin copiar); no se borró nada")
+        c.execute("DELETE FROM main.detalle_ventas WHERE venta_id IN (SELECT id FROM main.ventas WHERE ts >= ? AND ts < ?)", rango)
+        c.execute("DELETE FROM main.ventas WHERE ts >= ? AND ts < ?", rango)
+        return c.rowcount
+
+def podar_movimientos_enviados():
+    """Borra de la bitácora los movimientos ya subidos de los meses cerrados; devuelve cuántos.
+    productos.stock ya los contiene y la nube también: solo los pendientes hacen falta."""
+    with transaccion() as c:
+        c.execute("DELETE FROM movimientos_stock WHERE enviado = 1 AND fecha < ?", (inicio_base_viva().isoformat(),))
+        return c.rowcount
+
+def archivar_meses_cerrados():
+    """Archiva los meses cerrados pendientes; devuelve {'AAAA-MM': ventas movidas}"""
+    movidos = {}
+    for mes in meses_por_archivar():
+        n = archivar_mes(mes)
+        if n:
+            movidos[mes.isoformat()[:7]] = n
+    podar_movimientos_enviados()
+    return movidos
+
+def compactar_base():
+    """VACUUM de la base viva para devolver al disco lo que dejaron los meses archivados"""
+    almacen = _almacen_local()
+    with almacen['candado']:
+        almacen['escritor'].execute("VACUUM")
+
+def _hilo_archivado():
+    try:
+        archivar_meses_cerrados()
+    except Exception as e:
+        registrar_error("archivo", e)
+
+@st.cache_resource
+def _archivado_al_arrancar():
+    """Una vez por proceso y en segundo plano: la caja no espera al archivado"""
+    threading.Thread(target=_hilo_archivado, daemon=True, name="archivo").start()
+    return True
+
+_archivado_al_arrancar()
 
 # ==========================================
 # 6. CONEXIÓN A NUBE (Google Sheets)
 # ==========================================
-def get_gsheet_client():
+@st.cache_resource
+def _conexion_nube():
+    """Cliente y pestañas compartidos por todas las sesiones del proceso"""
+    return {'lock': threading.RLock(), 'credenciales': None, 'cliente': None, 'libro': None, 'hojas': {}}
+
+def _credenciales_nube():
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
     try:
         # Intento Local
-        return gspread.authorize(ServiceAccountCredentials.from_json_keyfile_name("credentials.json", scope))
+        return ServiceAccountCredentials.from_json_keyfile_name("credentials.json", scope)
     except FileNotFoundError:
         # Intento Nube (Secrets)
-        return gspread.authorize(ServiceAccountCredentials.from_json_keyfile_dict(st.secrets["gcp_service_account"], scope))
+        return ServiceAccountCredentials.from_json_keyfile_dict(st.secrets["gcp_service_account"], scope)
+
+def get_gsheet_client():
+    """Autoriza una sola vez por proceso y reutiliza el token"""
+    nube = _conexion_nube()
+    with nube['lock']:
+        if nube['cliente'] is None:
+            with medir("sheets.authorize"):
+                nube['credenciales'] = _credenciales_nube()
+                nube['cliente'] = gspread.authorize(nube['credenciales'])
+        elif nube['credenciales'].access_token_expired and hasattr(nube['cliente'], 'login'):
+            # Versiones viejas de gspread no refrescan el token solas
+            nube['cliente'].login()
+        return nube['cliente']
+
+def get_libro():
+    """El libro PapeleriaDB abierto una sola vez"""
+    nube = _conexion_nube()
+    with nube['lock']:
+        if nube['libro'] is None:
+            with medir("sheets.open"):
+                nube['libro'] = get_gsheet_client().open(HOJA_CALCULO)
+        return nube['libro']
+
+def get_hoja(nombre, encabezados=None):
+    """Pestaña del libro (Productos / Ventas_AAAA_MM) abierta una sola vez.
+    Si no existe y se dan encabezados, se crea con ellos."""
+    nube = _conexion_nube()
+    with nube['lock']:
+        hoja = nube['hojas'].get(nombre)
+        if hoja is None:
+            libro = get_libro()
+            try:
+                with medir("sheets.worksheet"):
+                    hoja = HojaMedida(libro.worksheet(nombre))
+            except gspread.WorksheetNotFound:
+                if encabezados is None:
+                    raise
+                with medir("sheets.add_worksheet"):
+                    hoja = HojaMedida(libro.add_worksheet(title=nombre, rows=1000, cols=len(encabezados)))
+                hoja.append_row(encabezados)
+            nube['hojas'][nombre] = hoja
+        return hoja
+
+class HojaMedida:
+    """Envuelve una pestaña de gspread: cada método llamado cuenta como sheets.<método>"""
+    __slots__ = ('_hoja',)
+
+    def __init__(self, hoja):
+        self._hoja = hoja
+
+    def __getattr__(self, nombre):
+        atributo = getattr(self._hoja, nombre)
+        if not callable(atributo):
+            return atributo
+        def medido(*args, **kwargs):
+            with medir(f"sheets.{nombre}"):
+                return atributo(*args, **kwargs)
+        return medido
+
+def invalidar_nube(reautorizar=False):
+    """Olvida las pestañas abiertas (y el cliente si se pide) para reabrirlas en la siguiente llamada"""
+    nube = _conexion_nube()
+    with nube['lock']:
+        nube['hojas'].clear()
+        nube['libro'] = None
+        if reautorizar:
+            nube['cliente'] = None
+            nube['credenciales'] = None
+
+def _fallo_nube(e):
+    """Tras un error se reabren las pestañas; si fue de permisos, también se reautoriza"""
+    registrar_error("nube", e)
+    estado_http = getattr(getattr(e, 'response', None), 'status_code', None)
+    invalidar_nube(reautorizar=estado_http in (401, 403))
+
+def aplicar_delta_productos(c, filas_nube):
+    """Compara la nube contra SQLite por código y escribe solo la diferencia.
+    Usa el cursor de la transacción en curso; devuelve (insertados, actualizados, eliminados)"""
+    locales = {cod: (nom, pre, stk) for cod, nom, pre, stk in
+               c.execute("SELECT codigo_barra, nombre, precio, stock FROM productos")}
+    pendientes = stock_pendiente(c)
+    
+    nuevos, cambios = [], []
+    for cod, (nom, pre, stk) in filas_nube.items():
+        # Stock local = lo que dice la nube + lo que esta terminal no ha subido
+        stk += pendientes.get(cod, 0)
+        actual = locales.get(cod)
+        if actual is None:
+            nuevos.append((cod, nom, pre, stk))
+        elif actual != (nom, pre, stk):
+            cambios.append((nom, pre, stk, cod))
+    borrados = [(cod,) for cod in locales.keys() - filas_nube.keys()]
+    
+    # UPDATE en vez de REPLACE para conservar el id (editando_id sigue siendo válido)
+    c.executemany("INSERT INTO productos (codigo_barra, nombre, precio, stock) VALUES (?, ?, ?, ?)", nuevos)
+    c.executemany("UPDATE productos SET nombre = ?, precio = ?, stock = ? WHERE codigo_barra = ?", cambios)
+    c.executemany("DELETE FROM productos WHERE codigo_barra = ?", borrados)
+    return len(nuevos), len(cambios), len(borrados)
+
+def marca_remota_inventario():
+    """Última modificación del libro según Drive (no baja datos)"""
+    libro = get_libro()
+    obtener = getattr(libro, 'get_lastUpdateTime', None)
+    with medir("drive.lastUpdateTime"):
+        return obtener() if obtener else libro.lastUpdateTime
 
 def sincronizar_inventario_descarga():
-    """Baja todo de Google y lo guarda en SQLite"""
-    try:
-        client = get_gsheet_client()
-        sheet = client.open("PapeleriaDB").worksheet("Productos")
-        datos = sheet.get_all_records()
-        
-        c = conn.cursor()
-        c.execute("DELETE FROM productos") # Limpiar local
-        
-        if datos:
+    """Baja todo de Google y aplica en SQLite solo lo que cambió"""
+    est = _estado_inventario()
+    with est['lock_sinc']:
+        try:
+            # La marca se lee antes de bajar: un cambio a media descarga se verá en la siguiente revisión
+            try:
+                marca = marca_remota_inventario()
+            except Exception as e:
+                registrar_error("nube", e)
+                marca = None
+            inicio = time.perf_counter()
+            sheet = get_hoja("Productos")
+            datos = sheet.get_all_records()
+            
+            # Si un código se repite en la hoja, gana la última fila
+            filas_nube = {}
             for p in datos:
                 if str(p['Codigo']) != "":
-                    c.execute("INSERT INTO productos (codigo_barra, nombre, precio, stock) VALUES (?, ?, ?, ?)",
-                              (str(p['Codigo']), p['Nombre'], float(p['Precio']), int(p['Stock'])))
-            conn.commit()
-            st.session_state.ultima_sinc = hora_actual()
-            return True, f"Sincronizado: {len(datos)} productos."
-        return True, "Nube vacía."
-    except Exception as e:
-        return False, f"Error: {e}"
+                    filas_nube[str(p['Codigo'])] = (str(p['Nombre']), float(p['Precio']), int(p['Stock']))
+            
+            with transaccion() as c:
+                ins, act, elim = aplicar_delta_productos(c, filas_nube)
+            if ins or act or elim:
+                recargar_indice_productos()
+                est['version'] += 1
+            registrar_filas_nube(datos)
+            est['sincronizado'] = est['revisado'] = time.time()
+            est['marca_remota'] = marca
+            est['ultima_sinc'] = hora_actual()
+            registrar_tiempo("inventario.sincronizar", time.perf_counter() - inicio)
+            if not datos:
+                return True, "Nube vacía."
+            return True, f"Sincronizado: {len(filas_nube)} productos ({ins} nuevos, {act} actualizados, {elim} eliminados)."
+        except Exception as e:
+            _fallo_nube(e)
+            return False, f"Error: {e}"
 
 def guardar_producto_nube(codigo, nombre, precio, stock):
     try:
-        client = get_gsheet_client()
-        sheet = client.open("PapeleriaDB").worksheet("Productos")
+        sheet = get_hoja("Productos")
         sheet.append_row([str(codigo), nombre, precio, stock])
+        olvidar_filas_nube()
         return True
-    except:
+    except Exception as e:
+        _fallo_nube(e)
         return False
 
 def editar_producto_nube(codigo_original, nuevo_nombre, nuevo_precio, nuevo_stock):
+    """Reescribe B:D de la fila del producto en una sola llamada"""
     try:
-        client = get_gsheet_client()
-        sheet = client.open("PapeleriaDB").worksheet("Productos")
-        cell = sheet.find(str(codigo_original))
-        if cell:
-            sheet.update_cell(cell.row, 2, nuevo_nombre)
-            sheet.update_cell(cell.row, 3, nuevo_precio)
-            sheet.update_cell(cell.row, 4, nuevo_stock)
-            return True
-        return False
-    except:
+        cod = str(codigo_original)
+        leidas = leer_filas_nube([cod])
+        if cod not in leidas:
+            return False
+        fila = leidas[cod][0]
+        get_hoja("Productos").batch_update([{'range': f"B{fila}:D{fila}", 'values': [[nuevo_nombre, nuevo_precio, nuevo_stock]]}])
+        return True
+    except Exception as e:
+        _fallo_nube(e)
         return False
 
 def eliminar_producto_nube(codigo):
     try:
-        client = get_gsheet_client()
-        sheet = client.open("PapeleriaDB").worksheet("Productos")
-        cell = sheet.find(str(codigo))
-        if cell:
-            sheet.delete_rows(cell.row)
+        cod = str(codigo)
+        leidas = leer_filas_nube([cod])
+        if cod in leidas:
+            fila = leidas[cod][0]
+            get_hoja("Productos").delete_rows(fila)
+            recorrer_filas_nube(cod, fila)
             return True
-    except:
+        return False
+    except Exception as e:
+        _fallo_nube(e)
         return False
 
-def registrar_venta_nube_historial(fecha, ticket_id, vendedor, total, resumen):
+def importar_productos_nube(filas, avance=None):
+    """Compara los productos del archivo contra la hoja y manda altas y cambios en pocas llamadas.
+    filas = {codigo: (nombre, precio, stock)}; stock None conserva el de la hoja (0 si es nuevo).
+    Devuelve (ok, msg, {codigo: resultado})"""
+    avance = avance or (lambda fraccion, texto: None)
     try:
-        client = get_gsheet_client()
-        sheet = client.open("PapeleriaDB").worksheet("Ventas")
-        sheet.append_row([str(fecha), ticket_id, vendedor, total, resumen])
-        return True
-    except:
-        return False
+        sheet = get_hoja("Productos")
+        avance(0.1, "Leyendo hoja Productos...")
+        datos = sheet.get_all_records()
+        actuales = {}
+        for i, p in enumerate(datos):
+            if str(p['Codigo']) != "":
+                actuales[str(p['Codigo'])] = (i + 2, (str(p['Nombre']), float(p['Precio'] or 0), int(p['Stock'] or 0)))
+        
+        resultados, nuevos, cambios = {}, [], []
+        for cod, (nombre, precio, stock) in filas.items():
+            if cod not in actuales:
+                nuevos.append([cod, nombre, precio, stock or 0])
+                resultados[cod] = "nuevo"
+                continue
+            fila, actual = actuales[cod]
+            if stock is None:
+                # Sin stock en el archivo (lista de precios): solo nombre y precio
+                if actual[:2] != (nombre, precio):
+                    cambios.append({'range': f"B{fila}:C{fila}", 'values': [[nombre, precio]]})
+                    resultados[cod] = "actualizado"
+                else:
+                    resultados[cod] = "sin cambios"
+            elif actual != (nombre, precio, stock):
+                cambios.append({'range': f"B{fila}:D{fila}", 'values': [[nombre, precio, stock]]})
+                resultados[cod] = "actualizado"
+            else:
+                resultados[cod] = "sin cambios"
+        
+        for i in range(0, len(cambios), IMPORTAR_RANGOS_POR_LLAMADA):
+            avance(0.2 + 0.6 * i / len(cambios), f"Actualizando {len(cambios)} productos en la nube...")
+            sheet.batch_update(cambios[i:i + IMPORTAR_RANGOS_POR_LLAMADA])
+        if nuevos:
+            avance(0.8, f"Agregando {len(nuevos)} productos nuevos en la nube...")
+            sheet.append_rows(nuevos)
+        
+        # Las filas nuevas quedan al final; si no, el índice se corrige solo en el siguiente uso
+        registrar_filas_nube(datos + [{'Codigo': f[0]} for f in nuevos])
+        return True, f"{len(nuevos)} nuevos, {len(cambios)} actualizados.", resultados
+    except Exception as e:
+        _fallo_nube(e)
+        return False, f"Error: {e}", {}
+
+def registrar_ventas_nube_lote(periodo, filas):
+    """Sube en una sola llamada varias ventas del mismo mes ('AAAA-MM') a su pestaña Ventas_AAAA_MM"""
+    try:
+        sheet = get_hoja(f"Ventas_{periodo.replace('-', '_')}", encabezados=ENCABEZADOS_VENTAS)
+        sheet.append_rows(filas)
+        return True, f"{len(filas)} ventas subidas."
+    except Exception as e:
+        _fallo_nube(e)
+        return False, f"Error: {e}"
+
+# Mapa código → número de fila en la pestaña Productos. Se arma con la
+# sincronización o leyendo solo la columna A, y se reconstruye cuando una
+# fila leída ya no tiene el código esperado (alguien movió la hoja).
+@st.cache_resource
+def _indice_filas_nube():
+    return {'lock': threading.Lock(), 'filas': None}
+
+def registrar_filas_nube(datos):
+    """Arma el índice desde un get_all_records ya descargado (fila 1 = encabezados)"""
+    idx = _indice_filas_nube()
+    with idx['lock']:
+        idx['filas'] = {str(p['Codigo']): i + 2 for i, p in enumerate(datos) if str(p['Codigo']) != ""}
+
+def recorrer_filas_nube(codigo, fila_borrada):
+    """Tras borrar una fila, las de abajo suben una posición"""
+    idx = _indice_filas_nube()
+    with idx['lock']:
+        if idx['filas'] is None:
+            return
+        idx['filas'].pop(codigo, None)
+        for cod, fila in idx['filas'].items():
+            if fila > fila_borrada:
+                idx['filas'][cod] = fila - 1
+
+def olvidar_filas_nube():
+    """Marca el índice como viejo; se vuelve a leer en el siguiente uso"""
+    idx = _indice_filas_nube()
+    with idx['lock']:
+        idx['filas'] = None
+
+def mapa_filas_nube(reconstruir=False):
+    idx = _indice_filas_nube()
+    with idx['lock']:
+        if idx['filas'] is None or reconstruir:
+            codigos = get_hoja("Productos").col_values(1, value_render_option='UNFORMATTED_VALUE')
+            idx['filas'] = {str(cod): i + 1 for i, cod in enumerate(codigos) if i > 0 and str(cod) != ""}
+        return idx['filas']
+
+def leer_filas_nube(codigos):
+    """Lee A:D solo de las filas pedidas en un batch_get y verifica que sigan en su lugar.
+    Devuelve {codigo: (fila, [codigo, nombre, precio, stock])}"""
+    sheet = get_hoja("Productos")
+    for intento in range(2):
+        mapa = mapa_filas_nube(reconstruir=intento > 0)
+        objetivos = [(cod, mapa[cod]) for cod in codigos if cod in mapa]
+        if not objetivos:
+            return {}
+        rangos = sheet.batch_get([f"A{fila}:D{fila}" for _, fila in objetivos], value_render_option='UNFORMATTED_VALUE')
+        leidas = {}
+        for (cod, fila), rango in zip(objetivos, rangos):
+            valores = (list(rango[0]) if rango else []) + [""] * 4
+            if str(valores[0]) != cod:
+                break
+            leidas[cod] = (fila, valores[:4])
+        else:
+            return leidas
+    raise RuntimeError("La pestaña Productos cambió mientras se leía")
 
 def actualizar_stock_nube_lote(lista_cambios):
-    """Actualización en LOTE para velocidad"""
+    """Suma deltas de stock [(codigo, delta)] leyendo y escribiendo solo las celdas D afectadas"""
     try:
-        client = get_gsheet_client()
-        sheet = client.open("PapeleriaDB").worksheet("Productos")
-        todos = sheet.get_all_records()
-        batch = []
+        cambios = defaultdict(int)
+        for cod, delta in lista_cambios:
+            cambios[str(cod)] += delta
         
-        mapa = {str(p['Codigo']): i + 2 for i, p in enumerate(todos)}
-        
-        for cod, cant in lista_cambios:
-            scod = str(cod)
-            if scod in mapa:
-                fila = mapa[scod]
-                curr = next((p['Stock'] for p in todos if str(p['Codigo']) == scod), 0)
-                batch.append({'range': f'D{fila}', 'values': [[int(curr) - cant]]})
+        leidas = leer_filas_nube(list(cambios))
+        batch = [{'range': f'D{fila}', 'values': [[int(valores[3] or 0) + cambios[cod]]]}
+                 for cod, (fila, valores) in leidas.items()]
         
         if batch: 
-            sheet.batch_update(batch)
-            st.session_state.ultima_sinc = hora_actual()
-            return True
-        return False
-    except:
-        return False
+            get_hoja("Productos").batch_update(batch)
+        return True, f"{len(batch)} productos actualizados."
+    except Exception as e:
+        _fallo_nube(e)
+        return False, f"Error: {e}"
+
+# ==========================================
+# 6.1 BANDEJA DE SALIDA (Cola hacia la nube)
+# ==========================================
+# Las ventas se guardan en SQLite junto con sus pendientes para la nube
+# (misma transacción). Un hilo de fondo las sube por lotes y reintenta
+# con espera exponencial si Google Sheets falla.
+
+def encolar_nube(c, tipo, datos):
+    """Agrega una operación pendiente usando el cursor de la transacción en curso"""
+    c.execute("INSERT INTO cola_nube (tipo, datos, creado) VALUES (?,?,?)",
+              (tipo, json.dumps(datos), hora_actual()))
+
+def profundidad_cola_nube():
+    """Cuántas operaciones faltan por subir (ventas + movimientos de stock)"""
+    return lector().execute("""SELECT (SELECT count(*) FROM cola_nube) 
+                                    + (SELECT count(*) FROM movimientos_stock WHERE enviado = 0)""").fetchone()[0]
+
+def _resolver_pendientes(pendientes, ok, mensaje):
+    """Borra lo que subió o programa el siguiente reintento con espera exponencial"""
+    with transaccion() as c:
+        if ok:
+            c.executemany("DELETE FROM cola_nube WHERE id = ?", [(i,) for i, _ in pendientes])
+        else:
+            ahora = time.time()
+            c.executemany("UPDATE cola_nube SET intentos = ?, proximo_intento = ?, ultimo_error = ? WHERE id = ?",
+                          [(n + 1, ahora + min(COLA_REINTENTO_BASE * 2 ** n, COLA_REINTENTO_MAX), mensaje, i)
+                           for i, n in pendientes])
+
+def escritura_propia(escribir):
+    """Corre escribir() -> (ok, msg) con lock_sinc ya tomado. Las subidas de la app también
+    mueven la marca de Drive; si antes de escribir nadie más había tocado el libro, se adopta
+    la marca nueva para que la siguiente revisión no baje el catálogo completo por nada."""
+    est = _estado_inventario()
+    previa = est['marca_remota']
+    def leer_marca():
+        try:
+            return marca_remota_inventario()
+        except Exception as e:
+            registrar_error("nube", e)
+            return None
+    antes = leer_marca() if previa is not None else None
+    ok, msg = escribir()
+    if ok and antes is not None and antes == previa:
+        est['marca_remota'] = leer_marca()
+    return ok, msg
+
+def subir_movimientos_stock(estado):
+    """Manda a la nube, en un solo lote, los deltas pendientes de la bitácora.
+    El lote se corta por productos distintos (COLA_LOTE_MAX), nunca a media referencia:
+    un ticket o una recepción completa siempre sube en el mismo batch_update."""
+    if time.time() < estado['stock_proximo']:
+        return 0, None
+    # Con el candado de sincronización, una descarga nunca ve un delta a medio marcar.
+    # Los pendientes se leen ya con el candado: si otro hilo sube a la vez, este ve
+    # marcado lo que aquel mandó y no lo repite.
+    with _estado_inventario()['lock_sinc']:
+        # Varias ventas del mismo producto se fusionan en un solo cambio
+        cambios, ids, referencia = defaultdict(int), [], None
+        cur = lector().execute("SELECT id, codigo_barra, delta, referencia FROM movimientos_stock WHERE enviado = 0 ORDER BY id")
+        for mov_id, cod, delta, ref in cur:
+            if ref != referencia and len(cambios) >= COLA_LOTE_MAX:
+                break
+            referencia = ref
+            cambios[cod] += delta
+            ids.append((mov_id,))
+        cur.close()
+        if not ids:
+            return 0, None
+        
+        ok, msg = escritura_propia(lambda: actualizar_stock_nube_lote(list(cambios.items())))
+        if ok:
+            with transaccion() as c:
+                c.executemany("UPDATE movimientos_stock SET enviado = 1 WHERE id = ?", ids)
+    
+    if ok:
+        estado['stock_intentos'] = 0
+        return len(cambios), None
+    estado['stock_proximo'] = time.time() + min(COLA_REINTENTO_BASE * 2 ** estado['stock_intentos'], COLA_REINTENTO_MAX)
+    estado['stock_intentos'] += 1
+    return 0, msg
+
+def vaciar_cola_nube(estado):
+    """Sube en lote las ventas pendientes y los movimientos de stock"""
+    errores = []
+    # Como con los movimientos: las ventas se leen, suben y borran sin soltar el candado,
+    # así un segundo hilo consumidor nunca repite un ticket en la hoja
+    with _estado_inventario()['lock_sinc']:
+        filas = lector().execute("SELECT id, tipo, datos, intentos FROM cola_nube WHERE proximo_intento <= ? ORDER BY id LIMIT ?",
+                                 (time.time(), COLA_LOTE_MAX)).fetchall()
+        ventas = [r for r in filas if r[1] == 'venta']
+        
+        # Cada mes va a su propia pestaña; se resuelve por mes para no repetir uno que ya subió
+        por_periodo = defaultdict(list)
+        for r in ventas:
+            v = json.loads(r[2])
+            por_periodo[str(v['fecha'])[:7]].append((r, [str(v['fecha']), v['ticket_id'], v['vendedor'], v['total'], v['resumen']]))
+        for periodo, grupo in por_periodo.items():
+            ok, msg = escritura_propia(lambda: registrar_ventas_nube_lote(periodo, [fila for _, fila in grupo]))
+            _resolver_pendientes([(r[0], r[3]) for r, _ in grupo], ok, msg)
+            if not ok: errores.append(msg)
+    
+    subidos, msg = subir_movimientos_stock(estado)
+    if msg: errores.append(msg)
+    
+    if not filas and not subidos and not errores:
+        return 0
+    estado['ultimo_error'] = " | ".join(errores) or None
+    if not errores:
+        estado['ultimo_envio'] = hora_actual()
+    return max(len(filas), subidos)
+
+def _hilo_cola_nube(estado):
+    while True:
+        estado['despertar'].wait(COLA_INTERVALO_SEGUNDOS)
+        estado['despertar'].clear()
+        try:
+            # Si hay rezago se siguen mandando lotes sin esperar el intervalo
+            while vaciar_cola_nube(estado) >= COLA_LOTE_MAX:
+                pass
+        except Exception as e:
+            registrar_error("cola", e)
+            estado['ultimo_error'] = f"Error: {e}"
+        try:
+            guardar_metricas()
+        except OSError:
+            pass
+
+@st.cache_resource
+def get_cola_nube():
+    """Arranca (una sola vez por proceso) el hilo que vacía la cola"""
+    estado = {'despertar': threading.Event(), 'ultimo_envio': None, 'ultimo_error': None,
+              'stock_intentos': 0, 'stock_proximo': 0.0}
+    threading.Thread(target=_hilo_cola_nube, args=(estado,), daemon=True, name="cola-nube").start()
+    return estado
+
+get_cola_nube()
+
+# ==========================================
+# 6.2 INVENTARIO COMPARTIDO (una copia por proceso)
+# ==========================================
+# Todas las sesiones usan el mismo catálogo local. Solo se vuelve a bajar
+# si venció, si Drive dice que la hoja cambió o si se pide a mano; y eso
+# pasa en segundo plano mientras haya un catálogo local que mostrar.
+
+@st.cache_resource
+def _estado_inventario():
+    return {'lock': threading.Lock(), 'lock_sinc': threading.Lock(), 'version': 0, 'sincronizado': 0.0, 'revisado': 0.0,
+            'marca_remota': None, 'ultima_sinc': "Pendiente", 'en_curso': False}
+
+def _refrescar_inventario(revisar_marca):
+    est = _estado_inventario()
+    try:
+        if revisar_marca:
+            marca = marca_remota_inventario()
+            if marca is not None and marca == est['marca_remota']:
+                return
+        sincronizar_inventario_descarga()
+    except Exception as e:
+        _fallo_nube(e)
+    finally:
+        est['en_curso'] = False
+
+def asegurar_inventario():
+    """Se llama en cada ejecución; casi siempre no hace nada"""
+    est = _estado_inventario()
+    ahora = time.time()
+    if ahora - est['revisado'] < INVENTARIO_REVISION_SEGUNDOS:
+        return
+    nunca = est['sincronizado'] == 0.0
+    
+    if nunca and not lector().execute("SELECT EXISTS (SELECT 1 FROM productos)").fetchone()[0]:
+        # Arranque en frío: no hay nada que vender sin el catálogo
+        est['revisado'] = ahora
+        with st.spinner("⚡ Conectando con la nube..."):
+            sincronizar_inventario_descarga()
+        return
+    
+    with est['lock']:
+        if est['en_curso']:
+            return
+        est['en_curso'] = True
+        est['revisado'] = ahora
+    revisar_marca = not nunca and ahora - est['sincronizado'] < INVENTARIO_TTL_SEGUNDOS
+    threading.Thread(target=_refrescar_inventario, args=(revisar_marca,), daemon=True, name="inventario").start()
 
 # ==========================================
 # 7. LÓGICA DE LA APLICACIÓN
 # ==========================================
 
 def login(u, p):
-    df = pd.read_sql("SELECT * FROM usuarios WHERE nombre=? AND password=?", conn, params=(u,p))
+    df = pd.read_sql("SELECT * FROM usuarios WHERE nombre=? AND password=?", lector(), params=(u,p))
     if not df.empty:
         st.session_state.logged_in = True
         st.session_state.usuario_actual = df.iloc[0]['nombre']
@@ -303,96 +1653,436 @@ def logout():
         del st.session_state[key]
     st.rerun()
 
+def agregar_al_carrito(prod, cant):
+    carrito = st.session_state.carrito
+    item = carrito.get(prod.codigo)
+    en_carrito = item['cantidad'] if item else 0
+    
+    if en_carrito + cant <= prod.stock:
+         # Agregar al carrito
+         if item:
+             item['cantidad'] += cant
+             item['subtotal'] = item['cantidad'] * item['precio']
+         else:
+             carrito[prod.codigo] = {
+                 "id": prod.id, 
+                 "codigo": prod.codigo, 
+                 "nombre": prod.nombre, 
+                 "precio": prod.precio, 
+                 "cantidad": cant, 
+                 "subtotal": cant * prod.precio
+             }
+         st.session_state.carrito_total = round(st.session_state.carrito_total + cant * prod.precio, 2)
+         
+         st.toast(f"✅ Agregado: {prod.nombre}")
+         
+         stock_restante = prod.stock - en_carrito - cant
+         if stock_restante < STOCK_BAJO:
+             st.warning(f"⚠️ ¡Atención! Quedan pocas unidades de {prod.nombre} ({stock_restante})")
+    else:
+        st.error(f"Stock insuficiente ({prod.stock} disponibles, {en_carrito} en el carrito)")
+
+def quitar_del_carrito(codigo):
+    item = st.session_state.carrito.pop(codigo, None)
+    if item:
+        st.session_state.carrito_total = round(st.session_state.carrito_total - item['subtotal'], 2)
+
+def vaciar_carrito():
+    st.session_state.carrito = {}
+    st.session_state.carrito_total = 0.0
+
 def scan_callback():
     """Se ejecuta al dar Enter en el buscador"""
     st.session_state.last_active = time.time() 
     codigo = st.session_state.input_scan
+    st.session_state.opciones_busqueda = []
     
     if codigo:
-        df = pd.read_sql("SELECT * FROM productos WHERE codigo_barra = ?", conn, params=(codigo,))
-        if df.empty: 
-            df = pd.read_sql("SELECT * FROM productos WHERE nombre LIKE ?", conn, params=(f"%{codigo}%",))
-        
-        if not df.empty:
-            prod = df.iloc[0]
-            cant = st.session_state.qty_scan
-            
-            if cant <= prod['stock']:
-                 # Agregar al carrito
-                 found = False
-                 for item in st.session_state.carrito:
-                     if item['id'] == prod['id']:
-                         item['cantidad'] += cant
-                         item['subtotal'] = item['cantidad'] * item['precio']
-                         found = True
-                         break
-                 
-                 if not found:
-                     st.session_state.carrito.append({
-                         "id": prod['id'], 
-                         "codigo": prod['codigo_barra'], 
-                         "nombre": prod['nombre'], 
-                         "precio": prod['precio'], 
-                         "cantidad": cant, 
-                         "subtotal": cant * prod['precio']
-                     })
-                 
-                 st.toast(f"✅ Agregado: {prod['nombre']}")
-                 
-                 stock_restante = prod['stock'] - cant
-                 if stock_restante < 5:
-                     st.warning(f"⚠️ ¡Atención! Quedan pocas unidades de {prod['nombre']} ({stock_restante})")
-            else:
-                st.error(f"Stock insuficiente ({prod['stock']} disponibles)")
+        inicio = time.perf_counter()
+        prod, opciones = resolver_escaneo(codigo)
+        if prod is not None:
+            agregar_al_carrito(prod, st.session_state.qty_scan)
+        elif opciones:
+            # Varias coincidencias: el cajero elige de la lista
+            st.session_state.opciones_busqueda = opciones
         else:
             st.toast("❌ Producto no encontrado")
+        registrar_tiempo("caja.escaneo", time.perf_counter() - inicio)
             
     st.session_state.input_scan = ""
 
+def resolver_escaneo(texto):
+    """Código exacto o, si no existe, búsqueda por nombre. Devuelve (producto, opciones):
+    producto cuando hay uno solo; si no, la lista de coincidencias (vacía si no hay nada)"""
+    prod = buscar_producto_codigo(texto)
+    if prod is not None:
+        return prod, []
+    opciones = buscar_productos_nombre(texto)
+    if len(opciones) == 1:
+        return opciones[0], []
+    return None, opciones
+
+def elegir_opcion_callback(i):
+    """Agrega al carrito el producto elegido de la lista de coincidencias"""
+    st.session_state.last_active = time.time()
+    agregar_al_carrito(st.session_state.opciones_busqueda[i], st.session_state.qty_scan)
+    st.session_state.opciones_busqueda = []
+
 def procesar_venta_final(vendedor, pago):
+    """Registra el carrito en una sola transacción. Si algún renglón dejaría el stock
+    en negativo no se guarda nada y se lanza ValueError; el carrito queda intacto."""
     st.session_state.last_active = time.time()
-    total = sum(i['subtotal'] for i in st.session_state.carrito)
-    fecha = hora_actual()
+    items = list(st.session_state.carrito.values())
+    ts = int(time.time())
+    fecha = hora_de_epoch(ts)
+    lineas = [(i['codigo'], i['nombre'], i['cantidad'], centavos(i['subtotal'])) for i in items]
+    total_centavos = sum(l[3] for l in lineas)
+    movimientos = [(i['codigo'], -i['cantidad']) for i in items]
+    resumen = ", ".join(f"({i['cantidad']}){i['nombre']}" for i in items)
     
-    c = conn.cursor()
-    c.execute("INSERT INTO ventas (fecha, total, vendedor) VALUES (?,?,?)", (fecha, total, vendedor))
-    v_id = c.lastrowid
+    try:
+        with transaccion() as c:
+            c.execute("INSERT INTO ventas (ts, fecha, total_centavos, vendedor) VALUES (?,?,?,?)", (ts, fecha, total_centavos, vendedor))
+            v_id = c.lastrowid
+            registrar_movimientos(c, 'venta', f"ticket {v_id}", movimientos, sin_negativos=True)
+            c.executemany('''INSERT INTO detalle_ventas (venta_id, producto_id, codigo_barra, producto_nombre, cantidad, 
+                                                       precio_centavos, subtotal_centavos) VALUES (?,?,?,?,?,?,?)''', 
+                          [(v_id, i['id'], i['codigo'], i['nombre'], i['cantidad'], centavos(i['precio']), centavos(i['subtotal']))
+                           for i in items])
+            sumar_venta_resumenes(c, fecha, vendedor, total_centavos, lineas)
+            encolar_nube(c, 'venta', {'fecha': fecha, 'ticket_id': v_id, 'vendedor': vendedor, 
+                                      'total': total_centavos / 100, 'resumen': resumen})
+    except ValueError:
+        # Otra caja vendió esas piezas después del escaneo: el índice se vuelve a leer
+        recargar_indice_productos()
+        raise
     
-    resumen = ""
-    ticket = f"{NOMBRE_NEGOCIO}\n{UBICACION}\n\nTICKET #{v_id}\nFECHA: {fecha}\nATENDIÓ: {vendedor}\n{'-'*30}\n"
+    mover_indice_productos(movimientos)
     
-    cambios_nube = []
+    # El hilo de fondo sube la venta; la caja no espera a Google Sheets
+    get_cola_nube()['despertar'].set()
     
-    for item in st.session_state.carrito:
-        c.execute("INSERT INTO detalle_ventas (venta_id, producto_nombre, cantidad, precio_unitario, subtotal) VALUES (?,?,?,?,?)", 
-                  (v_id, item['nombre'], item['cantidad'], item['precio'], item['subtotal']))
-        
-        c.execute("UPDATE productos SET stock = stock - ? WHERE codigo_barra = ?", (item['cantidad'], item['codigo']))
-        cambios_nube.append((item['codigo'], item['cantidad']))
-        ticket += f"{item['cantidad']} x {item['nombre'][:15]:<15} ${item['subtotal']:>6.2f}\n"
-        resumen += f"({item['cantidad']}){item['nombre']}, "
+    vaciar_carrito()
+    return formatear_ticket(v_id, fecha, vendedor, items, total_centavos / 100, pago)
+
+def formatear_ticket(v_id, fecha, vendedor, items, total, pago):
+    separador = '-' * 30
+    return "\n".join([
+        NOMBRE_NEGOCIO, UBICACION, "", f"TICKET #{v_id}", f"FECHA: {fecha}", f"ATENDIÓ: {vendedor}", separador,
+        *(f"{i['cantidad']} x {i['nombre'][:15]:<15} ${i['subtotal']:>6.2f}" for i in items),
+        separador,
+        f"TOTAL : {MONEDA}{total:>8.2f}", f"PAGO  : {MONEDA}{pago:>8.2f}", f"CAMBIO: {MONEDA}{pago - total:>8.2f}",
+        separador, "¡Gracias por su compra!",
+    ])
+
+# Recepción de mercancía: la lista se arma escaneando igual que en la caja y al
+# confirmar se suma todo en una transacción. Los deltas van a la bitácora con una
+# sola referencia y el hilo de la nube los sube juntos en un batch_update a Productos.
+
+def agregar_a_recepcion(prod, cant):
+    item = st.session_state.recepcion.get(prod.codigo)
+    if item:
+        item['cantidad'] += cant
+    else:
+        st.session_state.recepcion[prod.codigo] = {"codigo": prod.codigo, "nombre": prod.nombre, 
+                                                   "stock": prod.stock, "cantidad": cant}
+    st.toast(f"📦 +{cant} {prod.nombre}")
+
+def quitar_de_recepcion(codigo):
+    st.session_state.recepcion.pop(codigo, None)
+
+def vaciar_recepcion():
+    st.session_state.recepcion = {}
+
+def scan_recepcion_callback():
+    """Enter en el escáner de recepción: mismo flujo que la caja, sin revisar stock"""
+    st.session_state.last_active = time.time()
+    codigo = st.session_state.input_recepcion
+    st.session_state.opciones_recepcion = []
+    st.session_state.resumen_recepcion = None
+    
+    if codigo:
+        with medir("recepcion.escaneo"):
+            prod, opciones = resolver_escaneo(codigo)
+        if prod is not None:
+            agregar_a_recepcion(prod, st.session_state.qty_recepcion)
+        elif opciones:
+            st.session_state.opciones_recepcion = opciones
+        else:
+            st.toast("❌ Producto no encontrado. Dalo de alta en Inventario.")
+    
+    st.session_state.input_recepcion = ""
+
+def elegir_opcion_recepcion_callback(i):
+    st.session_state.last_active = time.time()
+    agregar_a_recepcion(st.session_state.opciones_recepcion[i], st.session_state.qty_recepcion)
+    st.session_state.opciones_recepcion = []
+
+def procesar_recepcion(usuario):
+    """Suma la lista completa al stock en una sola transacción. Si algún producto se borró
+    después del escaneo no se guarda nada y se lanza ValueError; la lista queda intacta."""
+    st.session_state.last_active = time.time()
+    items = list(st.session_state.recepcion.values())
+    fecha = hora_actual()
+    cambios = [(i['codigo'], i['cantidad']) for i in items]
+    
+    try:
+        with transaccion() as c:
+            registrar_movimientos(c, 'recepcion', f"recepción {usuario} {fecha}", cambios)
+            stock = dict(c.execute(f"SELECT codigo_barra, stock FROM productos WHERE codigo_barra IN "
+                                   f"({','.join('?' * len(cambios))})", [cod for cod, _ in cambios]))
+            faltantes = [cod for cod, _ in cambios if cod not in stock]
+            if faltantes:
+                raise ValueError("Ya no existen en el catálogo: " + ", ".join(faltantes))
+    except ValueError:
+        recargar_indice_productos()
+        raise
+    
+    mover_indice_productos(cambios)
+    get_cola_nube()['despertar'].set()
+    
+    vaciar_recepcion()
+    return formatear_recepcion(fecha, usuario, items, stock)
+
+def formatear_recepcion(fecha, usuario, items, stock):
+    separador = '-' * 34
+    return "\n".join([
+        NOMBRE_NEGOCIO, "RECEPCIÓN DE MERCANCÍA", f"FECHA: {fecha}", f"RECIBIÓ: {usuario}", separador,
+        *(f"+{i['cantidad']:<4} {i['nombre'][:15]:<15} stock {stock[i['codigo']]:>5}" for i in items),
+        separador,
+        f"PRODUCTOS: {len(items)}", f"PIEZAS   : {sum(i['cantidad'] for i in items)}",
+    ])
+
+def guardar_producto_local(codigo, nombre, precio, stock):
+    """Aplica en SQLite y en el índice un alta o edición ya hecha en la nube"""
+    with transaccion() as c:
+        guardar_productos_locales(c, {str(codigo): (nombre, float(precio), int(stock))})
+    fila = lector().execute("SELECT id, codigo_barra, nombre, precio, stock FROM productos WHERE codigo_barra = ?",
+                            (str(codigo),)).fetchone()
+    fijar_indice_producto(str(codigo), fila)
 
-    ticket += f"{'-'*30}\nTOTAL : {MONEDA}{total:>8.2f}\nPAGO  : {MONEDA}{pago:>8.2f}\nCAMBIO: {MONEDA}{pago-total:>8.2f}\n{'-'*30}\n¡Gracias por su compra!"
+def eliminar_producto_local(codigo):
+    with transaccion() as c:
+        c.execute("DELETE FROM productos WHERE codigo_barra = ?", (str(codigo),))
+    fijar_indice_producto(str(codigo), None)
+
+def leer_archivo_productos(archivo):
+    """CSV o Excel del proveedor con columnas Codigo, Nombre, Precio, Stock"""
+    if archivo.name.lower().endswith('.xlsx'):
+        df = pd.read_excel(archivo, dtype=str)
+    else:
+        df = pd.read_csv(archivo, dtype=str, sep=None, engine='python')
+    df.columns = [str(c).strip().lower().replace('ó', 'o') for c in df.columns]
+    return df.fillna("")
+
+def validar_importacion(df):
+    """Revisa cada renglón y quita códigos repetidos (gana el último).
+    Devuelve ({codigo: (nombre, precio, stock o None)}, {codigo: fila}, {fila: [codigo, resultado, detalle]})"""
+    faltantes = {'codigo', 'nombre', 'precio', 'stock'} - set(df.columns)
+    if faltantes:
+        raise ValueError(f"Faltan columnas: {', '.join(sorted(faltantes))}")
     
-    conn.commit()
+    validas, origen, resultados = {}, {}, {}
+    for i, r in enumerate(df[['codigo', 'nombre', 'precio', 'stock']].itertuples(index=False), start=2):
+        cod, nom = r.codigo.strip(), r.nombre.strip()
+        if not cod or not nom:
+            resultados[i] = [cod, "error", "código o nombre vacío"]
+            continue
+        try:
+            precio = float(r.precio.replace('$', '').replace(',', ''))
+            # Stock vacío: el producto existente conserva el suyo, no se pone en cero
+            cantidad = float(r.stock) if r.stock.strip() else None
+        except ValueError:
+            resultados[i] = [cod, "error", "precio o stock no es un número"]
+            continue
+        if not math.isfinite(precio) or (cantidad is not None and not math.isfinite(cantidad)):
+            resultados[i] = [cod, "error", "precio o stock no es un número"]
+            continue
+        if cantidad is not None and not cantidad.is_integer():
+            resultados[i] = [cod, "error", "stock con decimales"]
+            continue
+        stock = None if cantidad is None else int(cantidad)
+        if precio < 0 or (stock is not None and stock < 0):
+            resultados[i] = [cod, "error", "precio o stock negativo"]
+            continue
+        if cod in origen:
+            resultados[origen[cod]] = [cod, "omitido", f"código repetido en la fila {i}"]
+        validas[cod] = (nom, precio, stock)
+        origen[cod] = i
+        resultados[i] = [cod, "", ""]
+    return validas, origen, resultados
+
+def guardar_productos_locales(c, filas):
+    """Altas y cambios en SQLite con el cursor de la transacción en curso.
+    El stock recibido es un conteo absoluto ya escrito en la nube: los movimientos
+    pendientes de esos códigos quedan absorbidos y se anota el ajuste. Con stock None
+    solo cambian nombre y precio (un alta queda en 0)"""
+    fecha = hora_actual()
+    conteos = {cod: v[2] for cod, v in filas.items() if v[2] is not None}
+    c.executemany('''INSERT INTO movimientos_stock (codigo_barra, delta, tipo, referencia, fecha, enviado) 
+                     SELECT codigo_barra, ? - stock, 'ajuste', 'conteo', ?, 1 FROM productos 
+                     WHERE codigo_barra = ? AND stock != ?''',
+                  [(stock, fecha, cod, stock) for cod, stock in conteos.items()])
+    c.executemany("UPDATE movimientos_stock SET enviado = 1 WHERE enviado = 0 AND codigo_barra = ?", [(cod,) for cod in conteos])
+    c.executemany('''INSERT INTO productos (codigo_barra, nombre, precio, stock) VALUES (?, ?, ?, coalesce(?, 0))
+                     ON CONFLICT (codigo_barra) DO UPDATE SET 
+                         nombre = excluded.nombre, precio = excluded.precio, 
+                         stock = CASE WHEN ? IS NULL THEN stock ELSE excluded.stock END''',
+                  [(cod, nombre, precio, stock, stock) for cod, (nombre, precio, stock) in filas.items()])
+
+def importar_productos(archivo, avance):
+    """Importa el archivo a la nube y aplica el mismo cambio en local; devuelve (ok, msg, DataFrame de resultados)"""
+    avance(0.0, "Validando archivo...")
+    validas, origen, resultados = validar_importacion(leer_archivo_productos(archivo))
     
-    with st.spinner("Guardando en nube..."):
-        registrar_venta_nube_historial(fecha, v_id, vendedor, total, resumen)
-        actualizar_stock_nube_lote(cambios_nube)
+    with _estado_inventario()['lock_sinc']:
+        ok, msg, en_nube = importar_productos_nube(validas, avance) if validas else (True, "Nada que importar.", {})
+        if ok:
+            avance(0.9, "Guardando en el inventario local...")
+            with transaccion() as c:
+                guardar_productos_locales(c, {cod: validas[cod] for cod, res in en_nube.items() if res != "sin cambios"})
+    if ok:
+        recargar_indice_productos()
+    for cod, fila in origen.items():
+        resultados[fila][1] = en_nube.get(cod, "error")
+        resultados[fila][2] = "" if ok else msg
     
-    st.session_state.carrito = []
-    return ticket
+    avance(1.0, "Listo")
+    tabla = pd.DataFrame([[fila, *res] for fila, res in sorted(resultados.items())],
+                         columns=["Fila", "Codigo", "Resultado", "Detalle"])
+    return ok, msg, tabla
 
 # ==========================================
 # 8. INTERFAZ DE USUARIO
 # ==========================================
 
+# --- CAJA ---
+# Fragmento: escanear, quitar líneas o cobrar solo vuelve a dibujar esta
+# zona, no el menú ni la barra lateral.
+@st.fragment
+def pantalla_caja():
+    st.subheader("🛒 Caja Registradora")
+    set_focus_on_scan()
+    
+    c_scan, c_qty = st.columns([3, 1])
+    with c_qty:
+        st.number_input("Cant", 1, 100, 1, key="qty_scan")
+    with c_scan:
+        st.text_input("Escanear (Enter)", key="input_scan", on_change=scan_callback)
+
+    if st.session_state.opciones_busqueda:
+        st.caption("Varias coincidencias, elige una:")
+        for i, op in enumerate(st.session_state.opciones_busqueda):
+            st.button(f"{op.nombre} · ${op.precio:,.2f} · {op.stock} disp.", key=f"op_{i}",
+                      on_click=elegir_opcion_callback, args=(i,))
+
+    if st.session_state.carrito:
+        for cod, item in st.session_state.carrito.items():
+            c1, c2, c3, c4, c5 = st.columns([3, 1, 1, 1, 0.5])
+            c1.write(f"**{item['nombre']}**")
+            c2.write(f"${item['precio']}")
+            c3.write(f"x{item['cantidad']}")
+            c4.write(f"${item['subtotal']:.2f}")
+            c5.button("❌", key=f"d_c_{cod}", on_click=quitar_del_carrito, args=(cod,))
+        
+        st.button("🗑️ Vaciar Carrito", on_click=vaciar_carrito)
+        
+        st.divider()
+        total = st.session_state.carrito_total
+        c_tot, c_pag = st.columns(2)
+        with c_tot:
+            st.markdown(f"<div class='big-total'>Total: ${total:,.2f}</div>", unsafe_allow_html=True)
+        with c_pag:
+            pago = st.number_input("💵 Pago Cliente:", min_value=0.0, value=float(total))
+
+        if st.button("✅ COBRAR", type="primary", use_container_width=True):
+            if pago >= total:
+                try:
+                    with medir("caja.cobrar"):
+                        ticket = procesar_venta_final(st.session_state.usuario_actual, pago)
+                except ValueError as e:
+                    st.error(f"❌ Venta no registrada. {e}")
+                    return
+                st.balloons()
+                c1, c2 = st.columns([1,2])
+                with c1: st.markdown(f'<div class="ticket"><pre>{ticket}</pre></div>', unsafe_allow_html=True)
+                with c2: 
+                    st.success("Venta Registrada Exitosamente ✅")
+                    st.info("Copia en cola para Google Sheets")
+                time.sleep(2)
+                st.rerun(scope="fragment")
+            else:
+                st.error("Faltan fondos para cubrir el total.")
+    else:
+        st.markdown("""
+        <div class='empty-state'>
+            <h1>👋</h1>
+            <h3>Carrito Vacío</h3>
+            <p>Escanea un código de barras para comenzar una venta.</p>
+        </div>
+        """, unsafe_allow_html=True)
+
+# --- RECEPCIÓN ---
+@st.fragment
+def pantalla_recepcion():
+    st.subheader("📦 Recepción de Mercancía")
+    set_focus_on_scan()
+    
+    c_scan, c_qty = st.columns([3, 1])
+    with c_qty:
+        st.number_input("Cant", 1, 10000, 1, key="qty_recepcion")
+    with c_scan:
+        st.text_input("Escanear (Enter)", key="input_recepcion", on_change=scan_recepcion_callback)
+
+    if st.session_state.opciones_recepcion:
+        st.caption("Varias coincidencias, elige una:")
+        for i, op in enumerate(st.session_state.opciones_recepcion):
+            st.button(f"{op.nombre} · {op.codigo} · {op.stock} en stock", key=f"opr_{i}",
+                      on_click=elegir_opcion_recepcion_callback, args=(i,))
+
+    if st.session_state.recepcion:
+        for cod, item in st.session_state.recepcion.items():
+            c1, c2, c3, c4 = st.columns([3, 1, 1, 0.5])
+            c1.write(f"**{item['nombre']}** · {cod}")
+            c2.write(f"+{item['cantidad']}")
+            c3.write(f"{item['stock']} → {item['stock'] + item['cantidad']}")
+            c4.button("❌", key=f"d_r_{cod}", on_click=quitar_de_recepcion, args=(cod,))
+        
+        st.button("🗑️ Vaciar Lista", on_click=vaciar_recepcion)
+        st.divider()
+        piezas = sum(i['cantidad'] for i in st.session_state.recepcion.values())
+        st.markdown(f"<div class='big-total'>{len(st.session_state.recepcion)} productos · {piezas} piezas</div>", 
+                    unsafe_allow_html=True)
+        
+        if st.button("✅ CONFIRMAR RECEPCIÓN", type="primary", use_container_width=True):
+            try:
+                with medir("recepcion.confirmar"):
+                    st.session_state.resumen_recepcion = procesar_recepcion(st.session_state.usuario_actual)
+            except ValueError as e:
+                st.error(f"❌ Recepción no registrada. {e}")
+                return
+            st.rerun(scope="fragment")
+    elif st.session_state.resumen_recepcion:
+        resumen = st.session_state.resumen_recepcion
+        c1, c2 = st.columns([1, 2])
+        with c1: st.markdown(f'<div class="ticket"><pre>{resumen}</pre></div>', unsafe_allow_html=True)
+        with c2:
+            st.success("Recepción registrada ✅")
+            st.info("Cambios de stock en cola para Google Sheets")
+            st.download_button("🖨️ Descargar resumen", resumen.encode('utf-8'), "recepcion.txt")
+    else:
+        st.markdown("""
+        <div class='empty-state'>
+            <h1>📦</h1>
+            <h3>Lista Vacía</h3>
+            <p>Escanea cada producto recibido; repite el escaneo o ajusta la cantidad para sumar piezas.</p>
+        </div>
+        """, unsafe_allow_html=True)
+
+
 check_timeout() 
 
-if not st.session_state.inventario_sincronizado:
-    with st.spinner("⚡ Conectando con la nube..."):
-        sincronizar_inventario_descarga()
-    st.session_state.inventario_sincronizado = True
+asegurar_inventario()
 
 # --- LOGIN ---
 if not st.session_state.logged_in:
@@ -411,110 +2101,129 @@ else:
         st.image(LOGO_URL, width=80)
         st.markdown(f"**{NOMBRE_NEGOCIO}**")
         st.success("🟢 En Línea")
-        st.caption(f"Sync: {st.session_state.ultima_sinc}")
+        st.caption(f"Sync: {_estado_inventario()['ultima_sinc']}")
+        cola = get_cola_nube()
+        pendientes = profundidad_cola_nube()
+        if pendientes:
+            st.caption(f"☁️ Pendientes de subir: {pendientes}")
+        elif cola['ultimo_envio']:
+            st.caption(f"☁️ Última subida: {cola['ultimo_envio']}")
+        if cola['ultimo_error']:
+            st.warning(f"Nube sin respuesta, reintentando. {cola['ultimo_error']}")
         st.divider()
         st.write(f"👤 **{st.session_state.usuario_actual}**")
         if st.button("Cerrar Sesión"):
             logout()
         st.divider()
         if st.button("☁️ Recargar Inventario"):
-            sincronizar_inventario_descarga()
+            invalidar_nube()
+            ok, msg = sincronizar_inventario_descarga()
+            st.toast(("✅ " if ok else "❌ ") + msg)
             st.rerun()
 
     if st.session_state.rol_actual == "Gerente":
-        opciones_menu = ["Punto de Venta", "Reportes", "Inventario", "Usuarios"]
+        opciones_menu = ["Punto de Venta", "Reportes", "Inventario", "Recepción", "Usuarios", "Diagnóstico"]
     else:
         opciones_menu = ["Punto de Venta"]
 
     menu = st.sidebar.radio("Ir a:", opciones_menu)
+    inicio_pagina = time.perf_counter()
 
     if menu == "Punto de Venta":
-        st.subheader("🛒 Caja Registradora")
-        set_focus_on_scan()
-        
-        c_scan, c_qty = st.columns([3, 1])
-        with c_qty:
-            st.number_input("Cant", 1, 100, 1, key="qty_scan")
-        with c_scan:
-            st.text_input("Escanear (Enter)", key="input_scan", on_change=scan_callback)
-
-        if st.session_state.carrito:
-            for i, item in enumerate(st.session_state.carrito):
-                c1, c2, c3, c4, c5 = st.columns([3, 1, 1, 1, 0.5])
-                c1.write(f"**{item['nombre']}**")
-                c2.write(f"${item['precio']}")
-                c3.write(f"x{item['cantidad']}")
-                c4.write(f"${item['subtotal']:.2f}")
-                if c5.button("❌", key=f"d_c_{i}"):
-                    st.session_state.carrito.pop(i)
-                    st.rerun()
-            
-            if st.button("🗑️ Vaciar Carrito"):
-                st.session_state.carrito = []
-                st.rerun()
-            
-            st.divider()
-            total = sum(i['subtotal'] for i in st.session_state.carrito)
-            c_tot, c_pag = st.columns(2)
-            with c_tot:
-                st.markdown(f"<div class='big-total'>Total: ${total:,.2f}</div>", unsafe_allow_html=True)
-            with c_pag:
-                pago = st.number_input("💵 Pago Cliente:", min_value=0.0, value=float(total))
-
-            if st.button("✅ COBRAR", type="primary", use_container_width=True):
-                if pago >= total:
-                    ticket = procesar_venta_final(st.session_state.usuario_actual, pago)
-                    st.balloons()
-                    c1, c2 = st.columns([1,2])
-                    with c1: st.markdown(f'<div class="ticket"><pre>{ticket}</pre></div>', unsafe_allow_html=True)
-                    with c2: 
-                        st.success("Venta Registrada Exitosamente ✅")
-                        st.info("Copia guardada en Google Sheets")
-                    time.sleep(2)
-                    st.rerun()
-                else:
-                    st.error("Faltan fondos para cubrir el total.")
-        else:
-            st.markdown("""
-            <div class='empty-state'>
-                <h1>👋</h1>
-                <h3>Carrito Vacío</h3>
-                <p>Escanea un código de barras para comenzar una venta.</p>
-            </div>
-            """, unsafe_allow_html=True)
+        pantalla_caja()
 
     elif menu == "Reportes":
         st.subheader("📊 Dashboard Financiero")
-        df_ventas = pd.read_sql("SELECT * FROM ventas", conn)
-        df_detalles = pd.read_sql("SELECT * FROM detalle_ventas", conn)
+        db = lector()
+        f1, f2, f3 = st.columns([1, 2, 1])
+        periodo = f1.selectbox("Periodo", ["Hoy", "Esta semana", "Este mes", "Todo", "Personalizado"])
+        hoy = fecha_hoy()
+        desde, hasta = {
+            "Hoy": (hoy, hoy),
+            "Esta semana": (hoy - timedelta(days=hoy.weekday()), hoy),
+            "Este mes": (hoy.replace(day=1), hoy),
+            "Todo": (None, None),
+        }.get(periodo, (None, None))
+        if periodo == "Personalizado":
+            rango = f2.date_input("Rango", (hoy - timedelta(days=7), hoy))
+            if len(rango) == 2:
+                desde, hasta = rango
+        cajeros = [r[0] for r in db.execute("SELECT DISTINCT vendedor FROM resumen_ventas_dia ORDER BY 1")]
+        vendedor = f3.selectbox("Cajero", ["Todos"] + cajeros)
+        vendedor = None if vendedor == "Todos" else vendedor
+        
+        with medir("reportes.consulta"):
+            rep = consultar_reporte(desde, hasta, vendedor, version_reporte(desde, hasta, vendedor))
+        tickets, total_ing = rep['tickets'], rep['total']
         
-        if not df_ventas.empty:
+        if tickets:
             k1, k2, k3 = st.columns(3)
-            total_ing = df_ventas['total'].sum()
             k1.metric("💰 Ingresos", f"${total_ing:,.2f}")
-            k2.metric("🧾 Tickets", len(df_ventas))
-            avg_ticket = total_ing / len(df_ventas) if len(df_ventas) > 0 else 0
+            k2.metric("🧾 Tickets", tickets)
+            avg_ticket = total_ing / tickets
             k3.metric("📈 Promedio", f"${avg_ticket:,.2f}")
             st.divider()
             c1, c2 = st.columns(2)
             with c1:
                 st.markdown("##### 🏆 Top Productos")
-                if not df_detalles.empty:
-                    top_prods = df_detalles.groupby('producto_nombre')['cantidad'].sum().sort_values(ascending=False).head(5)
-                    st.bar_chart(top_prods)
+                st.bar_chart(rep['top']['cantidad'])
             with c2:
                 st.markdown("##### 📅 Ventas por Hora")
-                df_ventas['fecha'] = pd.to_datetime(df_ventas['fecha'])
-                ventas_hora = df_ventas.groupby(df_ventas['fecha'].dt.hour)['total'].sum()
-                st.line_chart(ventas_hora)
-            st.download_button("📥 Descargar Excel Completo", to_excel(df_ventas), "reporte_ventas.xlsx")
+                st.line_chart(rep['por_hora']['total'])
+            # El historial solo se lee cuando se pide la exportación
+            e1, e2 = st.columns([1, 3])
+            formato = e1.selectbox("Formato", list(FORMATOS_EXPORTACION), label_visibility="collapsed")
+            if e2.button("📥 Preparar exportación (ventas + detalle)"):
+                with st.spinner("Generando archivo..."), tempfile.TemporaryDirectory() as carpeta:
+                    with medir(f"reportes.exportar_{formato}"):
+                        ruta = exportar_ventas(formato, carpeta, desde, hasta, vendedor)
+                    with open(ruta, 'rb') as archivo:
+                        st.download_button(f"📥 Descargar {formato}", archivo, os.path.basename(ruta))
         else:
-            st.info("Aún no hay ventas registradas.")
+            st.info("No hay ventas registradas en este periodo.")
+        
+        st.divider()
+        st.markdown("##### 📦 Reabastecimiento")
+        r1, r2, r3 = st.columns(3)
+        ventana = r1.number_input("Días de venta a promediar", 1, 365, REORDEN_VENTANA_DIAS)
+        cobertura = r2.number_input("Días que debe cubrir el stock", 1, 365, REORDEN_COBERTURA_DIAS)
+        plazo = r3.number_input("Días de entrega del proveedor", 0, 90, REORDEN_PLAZO_DIAS)
+        with medir("reportes.reorden"):
+            reorden = consultar_reorden(hoy, ventana, cobertura, plazo, version_productos())
+        riesgo = reorden[reorden['en_riesgo']]
+        st.metric("Productos por agotarse", len(riesgo))
+        if not riesgo.empty:
+            tabla = riesgo[['codigo_barra', 'nombre', 'stock', 'por_dia', 'dias_cobertura', 'sugerido']].rename(columns={
+                'codigo_barra': 'Código', 'nombre': 'Producto', 'stock': 'Stock', 'por_dia': 'Venta diaria',
+                'dias_cobertura': 'Días de cobertura', 'sugerido': 'Pedir'})
+            st.dataframe(tabla.round({'Venta diaria': 2}), use_container_width=True, hide_index=True)
+            st.download_button("📥 Lista de pedido (CSV)", tabla.to_csv(index=False).encode('utf-8'),
+                               f"pedido_{hoy.isoformat()}.csv", "text/csv")
+        
+        with st.expander("🔧 Mantenimiento"):
+            archivados = meses_archivados()
+            st.caption(f"Meses archivados: {', '.join(archivados) if archivados else 'ninguno'} "
+                       f"(la base viva guarda los últimos {ARCHIVO_MESES_VIVOS})")
+            m1, m2 = st.columns(2)
+            if m1.button("Archivar meses cerrados"):
+                with st.spinner("Archivando..."):
+                    movidos = archivar_meses_cerrados()
+                st.success(", ".join(f"{mes}: {n} ventas" for mes, n in movidos.items()) if movidos else "Nada que archivar")
+            if m2.button("Compactar base (VACUUM)"):
+                with st.spinner("Compactando..."):
+                    compactar_base()
+                st.success("Base compactada")
+            if st.button("Recalcular resúmenes desde el historial"):
+                with transaccion() as c:
+                    reconstruir_resumenes(c)
+                consultar_reporte.clear()
+                consultar_reorden.clear()
+                st.success("Resúmenes recalculados")
 
     elif menu == "Inventario":
         st.subheader("📦 Inventario Nube")
         if st.session_state.editando_id:
-            prod_row = pd.read_sql(f"SELECT * FROM productos WHERE id={st.session_state.editando_id}", conn).iloc[0]
+            prod_row = pd.read_sql("SELECT * FROM productos WHERE id = ?", lector(), params=(int(st.session_state.editando_id),)).iloc[0]
             st.info(f"✏️ Editando: {prod_row['nombre']}")
             with st.form("edit_form"):
                 c1, c2 = st.columns(2)
@@ -522,8 +2231,12 @@ else:
                 np = c2.number_input("Precio", value=float(prod_row['precio']), min_value=0.01)
                 ns = st.number_input("Stock", value=int(prod_row['stock']))
                 if st.form_submit_button("Guardar Cambios"):
-                    if editar_producto_nube(prod_row['codigo_barra'], nn, np, ns):
-                        sincronizar_inventario_descarga()
+                    # El conteo absoluto no debe cruzarse con una subida de deltas del hilo de fondo
+                    with _estado_inventario()['lock_sinc']:
+                        ok = editar_producto_nube(prod_row['codigo_barra'], nn, np, ns)
+                        if ok:
+                            guardar_producto_local(prod_row['codigo_barra'], nn, np, ns)
+                    if ok:
                         st.session_state.editando_id = None
                         st.success("Producto actualizado")
                         st.rerun()
@@ -541,31 +2254,83 @@ else:
                 ns = c4.number_input("Stock", 1, key="new_s")
                 if st.button("Guardar en Nube"):
                     if nc and nn:
-                        if guardar_producto_nube(nc, nn, np, ns):
-                            sincronizar_inventario_descarga()
+                        # Igual que al editar: una descarga a medias no debe pisar el alta local
+                        with _estado_inventario()['lock_sinc']:
+                            ok = guardar_producto_nube(nc, nn, np, ns)
+                            if ok:
+                                guardar_producto_local(nc, nn, np, ns)
+                        if ok:
                             st.success("¡Guardado!")
                             st.rerun()
                         else: st.error("Error")
                     else: st.warning("Faltan datos")
-            df = pd.read_sql("SELECT * FROM productos", conn)
-            st.dataframe(df[['codigo_barra', 'nombre', 'precio', 'stock']], use_container_width=True)
+            with st.expander("📥 Importar productos (CSV / Excel)"):
+                st.caption("Columnas: Codigo, Nombre, Precio, Stock. Los códigos existentes se actualizan; con Stock vacío conservan su stock.")
+                archivo = st.file_uploader("Lista de productos", type=["csv", "xlsx"])
+                if archivo and st.button("Importar lista"):
+                    barra = st.progress(0.0, "Validando archivo...")
+                    try:
+                        ok, msg, tabla = importar_productos(archivo, lambda fraccion, texto: barra.progress(fraccion, texto))
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        (st.success if ok else st.error)(msg)
+                        st.dataframe(tabla["Resultado"].value_counts())
+                        st.dataframe(tabla, use_container_width=True, hide_index=True)
+            f1, f2, f3, f4, f5 = st.columns([3, 1, 1, 1, 2])
+            texto = f1.text_input("Buscar por código o nombre")
+            precio_min = f2.number_input("Precio mín.", 0.0, value=0.0)
+            precio_max = f3.number_input("Precio máx.", 0.0, value=0.0, help="0 = sin límite")
+            f4.write(""); f4.write("")
+            stock_bajo = f4.checkbox(f"Stock < {STOCK_BAJO}")
+            orden = f5.selectbox("Ordenar por", list(ORDENES_INVENTARIO))
+            
+            filtro = (texto.strip(), stock_bajo, precio_min, precio_max, orden)
+            if st.session_state.get('filtro_inventario') != filtro:
+                st.session_state.filtro_inventario = filtro
+                st.session_state.pagina_inventario = 0
+            pagina = st.session_state.get('pagina_inventario', 0)
+            total, df = consultar_inventario(*filtro, pagina, version_productos())
+            paginas = max(1, -(-total // INVENTARIO_POR_PAGINA))
+            if pagina >= paginas:
+                # El catálogo se achicó (borrado o sincronización)
+                pagina = st.session_state.pagina_inventario = paginas - 1
+                total, df = consultar_inventario(*filtro, pagina, version_productos())
+            
+            st.dataframe(df[['codigo_barra', 'nombre', 'precio', 'stock']], use_container_width=True, hide_index=True)
+            p1, p2, p3 = st.columns([1, 2, 1])
+            if p1.button("◀ Anterior", disabled=pagina == 0):
+                st.session_state.pagina_inventario = pagina - 1
+                st.rerun()
+            p2.caption(f"Página {pagina + 1} de {paginas} · {total} productos")
+            if p3.button("Siguiente ▶", disabled=pagina >= paginas - 1):
+                st.session_state.pagina_inventario = pagina + 1
+                st.rerun()
+            
             st.divider()
-            col_act1, col_act2 = st.columns(2)
-            with col_act1:
-                prod_accion = st.selectbox("Selecciona un producto:", df['nombre'])
-            with col_act2:
-                st.write(""); st.write("")
-                c_edit, c_del = st.columns(2)
-                if c_edit.button("✏️ Editar"):
-                    id_sel = df[df['nombre'] == prod_accion].iloc[0]['id']
-                    st.session_state.editando_id = id_sel
-                    st.rerun()
-                if c_del.button("🗑️ Borrar"):
-                    cod_sel = df[df['nombre'] == prod_accion].iloc[0]['codigo_barra']
-                    if eliminar_producto_nube(cod_sel):
-                        sincronizar_inventario_descarga()
-                        st.success("Eliminado")
+            if not df.empty:
+                filas = {int(r.id): r for r in df.itertuples()}
+                col_act1, col_act2 = st.columns(2)
+                with col_act1:
+                    id_sel = st.selectbox("Selecciona un producto:", list(filas),
+                                          format_func=lambda i: f"{filas[i].codigo_barra} · {filas[i].nombre}")
+                with col_act2:
+                    st.write(""); st.write("")
+                    c_edit, c_del = st.columns(2)
+                    if c_edit.button("✏️ Editar"):
+                        st.session_state.editando_id = id_sel
                         st.rerun()
+                    if c_del.button("🗑️ Borrar"):
+                        with _estado_inventario()['lock_sinc']:
+                            ok = eliminar_producto_nube(filas[id_sel].codigo_barra)
+                            if ok:
+                                eliminar_producto_local(filas[id_sel].codigo_barra)
+                        if ok:
+                            st.success("Eliminado")
+                            st.rerun()
+
+    elif menu == "Recepción":
+        pantalla_recepcion()
 
     elif menu == "Usuarios":
         st.subheader("👥 Gestión de Personal")
@@ -576,12 +2341,42 @@ else:
             ur = c3.selectbox("Rol", ["Empleado", "Gerente"])
             if st.form_submit_button("Crear Usuario"):
                 try:
-                    c = conn.cursor()
-                    c.execute("INSERT INTO usuarios (nombre, password, rol) VALUES (?,?,?)", (un, up, ur))
-                    conn.commit()
+                    with transaccion() as c:
+                        c.execute("INSERT INTO usuarios (nombre, password, rol) VALUES (?,?,?)", (un, up, ur))
                     st.success("Usuario creado")
                     st.rerun()
                 except sqlite3.IntegrityError:
                     st.error("Usuario ya existe")
         st.write("Usuarios registrados:")
-        st.dataframe(pd.read_sql("SELECT nombre, rol FROM usuarios", conn), use_container_width=True)
\ No newline at end of file
+        st.dataframe(pd.read_sql("SELECT nombre, rol FROM usuarios", lector()), use_container_width=True)
+
+    elif menu == "Diagnóstico":
+        st.subheader("🩺 Diagnóstico")
+        cola, est = get_cola_nube(), _estado_inventario()
+        d1, d2, d3 = st.columns(3)
+        d1.metric("Pendientes de subir", profundidad_cola_nube())
+        d2.metric("Última subida", cola['ultimo_envio'] or "—")
+        d3.metric("Inventario sincronizado", est['ultima_sinc'])
+        if cola['ultimo_error']:
+            st.warning(f"Último error de la cola: {cola['ultimo_error']}")
+
+        st.write("Tiempos (últimas %d muestras por operación):" % METRICAS_MUESTRAS)
+        metricas = pd.DataFrame(resumen_metricas(), columns=['Operación', 'Llamadas', 'Errores', 'p50 ms', 'p95 ms', 'p99 ms'])
+        st.dataframe(metricas.sort_values('p95 ms', ascending=False), use_container_width=True, hide_index=True)
+
+        errores = list(_metricas()['ultimos_errores'])
+        if errores:
+            st.write("Errores recientes:")
+            st.dataframe(pd.DataFrame(errores[::-1], columns=['Hora', 'Operación', 'Error']), use_container_width=True, hide_index=True)
+
+        g1, g2 = st.columns(2)
+        if g1.button("💾 Guardar en archivo"):
+            guardar_metricas(forzar=True)
+            st.toast(f"Guardado en {METRICAS_ARCHIVO}")
+        if g2.button("🧹 Reiniciar métricas"):
+            _metricas.clear()
+            if os.path.exists(METRICAS_ARCHIVO):
+                os.remove(METRICAS_ARCHIVO)
+            st.rerun()
+
+    registrar_tiempo(f"ui.{menu}", time.perf_counter() - inicio_pagina)
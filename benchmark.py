@@ -0,0 +1,452 @@
+"""
+Banco de pruebas de rendimiento, sin internet.
+
+Reemplaza Google Sheets por una hoja en memoria (con latencia configurable),
+genera un catálogo y un historial de ventas sintéticos y mide las rutas
+críticas de app.py: escaneo, cobro, sincronización, reportes y exportación.
+
+    python benchmark.py                       # compara contra benchmark_base.json
+    python benchmark.py --skus 1000,200000    # otros tamaños de catálogo
+    python benchmark.py --guardar-base        # registra la línea base actual
+
+Cada tamaño de catálogo corre en un proceso aparte con su propia base SQLite.
+Si una operación es más lenta que la base (más la tolerancia) o hace más
+llamadas a Sheets, el comando termina con código 1.
+"""
+import argparse
+import atexit
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+ARCHIVO_BASE = os.path.join(RAIZ, "benchmark_base.json")
+ENCABEZADOS_PRODUCTOS = ["Codigo", "Nombre", "Precio", "Stock"]
+VENDEDORES = ["caja1", "caja2", "gerente"]
+
+# ==========================================
+# 1. GOOGLE SHEETS EN MEMORIA
+# ==========================================
+class Celda:
+    def __init__(self, row, col, value):
+        self.row, self.col, self.value = row, col, value
+
+def _columna(letras):
+    n = 0
+    for letra in letras:
+        n = n * 26 + ord(letra) - 64
+    return n
+
+def _rango(a1):
+    """'B5:D5' -> (fila1, col1, fila2, col2), con índices desde 1"""
+    m = re.fullmatch(r"([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?", a1)
+    if not m:
+        raise ValueError(f"Rango no soportado: {a1}")
+    c1, f1 = _columna(m.group(1)), int(m.group(2))
+    c2, f2 = (_columna(m.group(3)), int(m.group(4))) if m.group(3) else (c1, f1)
+    return f1, c1, f2, c2
+
+class HojaFalsa:
+    """Las llamadas de gspread que usa app.py, sobre una lista de filas (fila 1 = encabezados)"""
+
+    def __init__(self, libro, nombre, filas):
+        self.libro, self.title, self.filas = libro, nombre, filas
+
+    def _llamada(self, metodo, escritura=False):
+        self.libro.registrar(metodo)
+        if self.libro.latencia:
+            time.sleep(self.libro.latencia)
+        if escritura:
+            self.libro.lastUpdateTime = datetime.now(timezone.utc).isoformat()
+
+    def _celda(self, fila, col):
+        while len(self.filas) < fila:
+            self.filas.append([])
+        renglon = self.filas[fila - 1]
+        while len(renglon) < col:
+            renglon.append("")
+        return renglon
+
+    def get_all_records(self, **kwargs):
+        self._llamada("get_all_records")
+        encabezados = self.filas[0]
+        relleno = [""] * len(encabezados)
+        return [dict(zip(encabezados, list(f) + relleno)) for f in self.filas[1:] if any(v != "" for v in f)]
+
+    def get_all_values(self, **kwargs):
+        self._llamada("get_all_values")
+        return [list(f) for f in self.filas]
+
+    def col_values(self, col, **kwargs):
+        self._llamada("col_values")
+        return [f[col - 1] if len(f) >= col else "" for f in self.filas]
+
+    def find(self, query, in_column=None, **kwargs):
+        self._llamada("find")
+        for i, fila in enumerate(self.filas, start=1):
+            for j, valor in enumerate(fila, start=1):
+                if (in_column is None or j == in_column) and str(valor) == str(query):
+                    return Celda(i, j, valor)
+        return None
+
+    def update_cell(self, row, col, value):
+        self._llamada("update_cell", escritura=True)
+        self._celda(row, col)[col - 1] = value
+
+    def append_row(self, values, **kwargs):
+        self._llamada("append_row", escritura=True)
+        self.filas.append(list(values))
+
+    def append_rows(self, values, **kwargs):
+        self._llamada("append_rows", escritura=True)
+        self.filas.extend(list(v) for v in values)
+
+    def batch_get(self, rangos, **kwargs):
+        self._llamada("batch_get")
+        salida = []
+        for a1 in rangos:
+            f1, c1, f2, c2 = _rango(a1)
+            salida.append([list(self.filas[f - 1][c1 - 1:c2]) for f in range(f1, min(f2, len(self.filas)) + 1)])
+        return salida
+
+    def batch_update(self, datos, **kwargs):
+        self._llamada("batch_update", escritura=True)
+        for d in datos:
+            f1, c1, _, _ = _rango(d['range'])
+            for i, valores in enumerate(d['values']):
+                renglon = self._celda(f1 + i, c1 + len(valores) - 1)
+                renglon[c1 - 1:c1 - 1 + len(valores)] = valores
+
+    def delete_rows(self, inicio, fin=None):
+        self._llamada("delete_rows", escritura=True)
+        del self.filas[inicio - 1:(fin or inicio)]
+
+class LibroFalso:
+    """Libro con pestañas en memoria; cuenta las llamadas por método"""
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.lastUpdateTime = datetime.now(timezone.utc).isoformat()
+        self.hojas = {}
+        self.llamadas = Counter()
+        self._lock = threading.Lock()
+
+    def registrar(self, metodo):
+        with self._lock:
+            self.llamadas[metodo] += 1
+
+    def get_lastUpdateTime(self):
+        # La marca de Drive es una llamada a la API como cualquier otra: cuenta y tarda
+        self.registrar("get_lastUpdateTime")
+        if self.latencia:
+            time.sleep(self.latencia)
+        return self.lastUpdateTime
+
+    def total_llamadas(self):
+        with self._lock:
+            return sum(self.llamadas.values())
+
+    def agregar(self, nombre, filas):
+        self.hojas[nombre] = HojaFalsa(self, nombre, filas)
+        return self.hojas[nombre]
+
+    def worksheet(self, nombre):
+        self.registrar("worksheet")
+        if nombre not in self.hojas:
+            import gspread
+            raise gspread.WorksheetNotFound(nombre)
+        return self.hojas[nombre]
+
+    def add_worksheet(self, title, rows, cols, **kwargs):
+        self.registrar("add_worksheet")
+        return self.agregar(title, [])
+
+class ClienteFalso:
+    def __init__(self, libro):
+        self.libro = libro
+
+    def open(self, nombre):
+        self.libro.registrar("open")
+        return self.libro
+
+class CredencialesFalsas:
+    access_token_expired = False
+
+# ==========================================
+# 2. DATOS SINTÉTICOS
+# ==========================================
+TIPOS = ["Cuaderno", "Lápiz", "Pluma", "Borrador", "Marcador", "Folder", "Carpeta", "Tijeras", "Regla",
+         "Pegamento", "Cartulina", "Sacapuntas", "Calculadora", "Engrapadora", "Clips", "Post-it"]
+MARCAS = ["Scribe", "Bic", "Pelikan", "Maped", "Norma", "Pritt", "Dixon", "Sharpie", "Faber", "Casio"]
+DETALLES = ["rojo", "azul", "negro", "verde", "profesional", "escolar", "chico", "grande", "doble", "neón"]
+
+def generar_catalogo(n, semilla=7):
+    """Filas [codigo, nombre, precio, stock] con códigos EAN-13 únicos y nombres con acentos"""
+    rng = random.Random(semilla)
+    return [[f"750{i:010d}", f"{rng.choice(TIPOS)} {rng.choice(MARCAS)} {rng.choice(DETALLES)} {i}",
+             round(rng.uniform(3, 450), 2), rng.randint(50_000, 90_000)] for i in range(1, n + 1)]
+
+def generar_historial(app, catalogo, n_ventas, dias=120, semilla=11):
+    """Inserta n_ventas tickets de 1 a 6 renglones repartidos en los últimos `dias` días"""
+    rng = random.Random(semilla)
+    ahora = datetime.strptime(app.hora_actual(), "%Y-%m-%d %H:%M:%S")
+    with app.transaccion() as c:
+        ids = dict(c.execute("SELECT codigo_barra, id FROM productos"))
+        siguiente = (c.execute("SELECT coalesce(max(id), 0) FROM ventas").fetchone()[0] or 0) + 1
+        ventas, detalle = [], []
+        for v_id in range(siguiente, siguiente + n_ventas):
+            fecha = (ahora - timedelta(seconds=rng.randint(0, dias * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+            total = 0
+            for codigo, nombre, precio, _ in rng.sample(catalogo, rng.randint(1, min(6, len(catalogo)))):
+                cantidad, precio_c = rng.randint(1, 4), app.centavos(precio)
+                detalle.append((v_id, ids.get(codigo), codigo, nombre, cantidad, precio_c, cantidad * precio_c))
+                total += cantidad * precio_c
+            ventas.append((v_id, app.epoch_de_fecha(fecha), fecha, total, rng.choice(VENDEDORES)))
+        c.executemany("INSERT INTO ventas (id, ts, fecha, total_centavos, vendedor) VALUES (?,?,?,?,?)", ventas)
+        c.executemany("INSERT INTO detalle_ventas (venta_id, producto_id, codigo_barra, producto_nombre, cantidad, "
+                      "precio_centavos, subtotal_centavos) VALUES (?,?,?,?,?,?,?)", detalle)
+        app.reconstruir_resumenes(c)
+
+# ==========================================
+# 3. MEDICIÓN DE UN TAMAÑO DE CATÁLOGO
+# ==========================================
+class SesionFalsa(dict):
+    """st.session_state fuera de `streamlit run`: un dict con acceso por atributo"""
+    def __getattr__(self, nombre):
+        try:
+            return self[nombre]
+        except KeyError:
+            raise AttributeError(nombre) from None
+
+    def __setattr__(self, nombre, valor):
+        self[nombre] = valor
+
+def _cargar_app(libro):
+    """Importa app.py conectado al libro falso (sin credenciales ni red)"""
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+    import streamlit as st
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    st.session_state = SesionFalsa()
+    # Corre en una carpeta temporal: ningún secrets.toml del proyecto está a la vista
+    st.secrets = {}
+    gspread.authorize = lambda credenciales: ClienteFalso(libro)
+    ServiceAccountCredentials.from_json_keyfile_name = staticmethod(lambda *a, **k: CredencialesFalsas())
+    sys.path.insert(0, RAIZ)
+    import app
+    return app
+
+def _resumen(muestras, llamadas):
+    ordenadas = sorted(muestras)
+    return {'n': len(ordenadas),
+            'mediana_ms': round(statistics.median(ordenadas) * 1000, 3),
+            'p95_ms': round(ordenadas[min(len(ordenadas) - 1, int(0.95 * len(ordenadas)))] * 1000, 3),
+            'llamadas_sheets': round(llamadas / len(ordenadas), 2)}
+
+def medir_tamano(skus, ventas, latencia, repeticiones):
+    libro = LibroFalso(latencia)
+    catalogo = generar_catalogo(skus)
+    libro.agregar("Productos", [list(ENCABEZADOS_PRODUCTOS)] + [list(f) for f in catalogo])
+
+    carpeta = tempfile.mkdtemp(prefix="bench_pos_")
+    atexit.register(shutil.rmtree, carpeta, True)
+    os.chdir(carpeta)
+    resultados = {}
+
+    def medir(nombre, funcion, veces, preparar=None):
+        muestras, llamadas = [], 0
+        for i in range(veces):
+            if preparar:
+                preparar(i)
+            antes = libro.total_llamadas()
+            inicio = time.perf_counter()
+            funcion(i)
+            muestras.append(time.perf_counter() - inicio)
+            llamadas += libro.total_llamadas() - antes
+        resultados[nombre] = _resumen(muestras, llamadas)
+
+    # Arranque: crea la base y baja el catálogo completo (arranque en frío)
+    inicio = time.perf_counter()
+    app = _cargar_app(libro)
+    resultados['arranque'] = _resumen([time.perf_counter() - inicio], libro.total_llamadas())
+
+    # El banco maneja la cola a mano: el hilo de fondo queda sin trabajo
+    vaciar_cola = app.vaciar_cola_nube
+    app.vaciar_cola_nube = lambda estado: 0
+    estado_cola = app.get_cola_nube()
+
+    # Reportes y reabastecimiento sin ventas ("Hoy" recién abierto, un cajero sin tickets): vacíos, sin error
+    hoy = app.fecha_hoy()
+    for filtro in ((hoy, hoy, None), (hoy - timedelta(days=30), hoy, "sin_ventas")):
+        assert app.consultar_reporte(*filtro, app.version_reporte(*filtro))['top'].empty, filtro
+    sin_ventas = app.consultar_reorden(hoy, app.REORDEN_VENTANA_DIAS, app.REORDEN_COBERTURA_DIAS, app.REORDEN_PLAZO_DIAS,
+                                       app.version_productos())
+    assert not sin_ventas['en_riesgo'].any() and (sin_ventas['sugerido'] == 0).all()
+    app.consultar_reorden.clear()
+
+    rng = random.Random(3)
+    hoja = libro.hojas["Productos"]
+
+    medir("sync.sin_cambios", lambda i: app.sincronizar_inventario_descarga(), max(3, repeticiones // 10))
+
+    def cambiar_precios(i):
+        for fila in rng.sample(range(2, len(hoja.filas) + 1), max(1, skus // 100)):
+            hoja.filas[fila - 1][2] = round(hoja.filas[fila - 1][2] + 1, 2)
+    medir("sync.delta_1pct", lambda i: app.sincronizar_inventario_descarga(), max(3, repeticiones // 10), cambiar_precios)
+
+    # Caja: escaneo por código exacto y por nombre
+    sesion = app.st.session_state
+    sesion.qty_scan = 1
+    codigos = [f[0] for f in rng.sample(catalogo, min(skus, repeticiones * 5))]
+
+    def escanear(texto):
+        if len(sesion.carrito) >= 20:
+            app.vaciar_carrito()
+        sesion.input_scan = texto
+        app.scan_callback()
+    medir("caja.escaneo_codigo", lambda i: escanear(codigos[i % len(codigos)]), repeticiones * 5)
+    nombres = [" ".join(f[1].split()[:2]) + " " + f[1].split()[2][:3] for f in rng.sample(catalogo, min(skus, repeticiones))]
+    medir("caja.escaneo_nombre", lambda i: escanear(nombres[i % len(nombres)]), repeticiones)
+    app.vaciar_carrito()
+
+    # Cobro de tickets de 5 renglones; la subida se mide aparte
+    def llenar_carrito(i):
+        app.vaciar_carrito()
+        for cod in rng.sample(codigos, min(5, len(codigos))):
+            app.agregar_al_carrito(app.buscar_producto_codigo(cod), 1)
+    medir("caja.cobrar", lambda i: app.procesar_venta_final("caja1", sesion.carrito_total + 100), repeticiones, llenar_carrito)
+
+    def subir(i):
+        while vaciar_cola(estado_cola):
+            pass
+    medir("cola.subir", subir, 1)
+
+    # Recepción de un pedido de 300 renglones y su subida a Productos
+    sesion.qty_recepcion = 12
+    recibidos = [f[0] for f in rng.sample(catalogo, min(skus, 300))]
+
+    def llenar_recepcion(i):
+        for cod in recibidos:
+            sesion.input_recepcion = cod
+            app.scan_recepcion_callback()
+    medir("recepcion.confirmar", lambda i: app.procesar_recepcion("almacen"), 1, llenar_recepcion)
+    medir("cola.subir_recepcion", subir, 1)
+
+    # Reportes y exportación sobre el historial sintético
+    generar_historial(app, catalogo, ventas)
+    # Los meses cerrados del historial pasan a sus archivos; los reportes recorren ambos
+    medir("archivo.meses_cerrados", lambda i: app.archivar_meses_cerrados(), 1)
+    for nombre, filtro in (("reportes.mes", (hoy - timedelta(days=30), hoy, None)),
+                           ("reportes.todo", (None, None, None)),
+                           ("reportes.cajero_mes", (hoy - timedelta(days=30), hoy, "caja2"))):
+        def consultar(i, filtro=filtro):
+            app.consultar_reporte.clear()
+            app.consultar_reporte(*filtro, app.version_reporte(*filtro))
+        medir(nombre, consultar, max(3, repeticiones // 3))
+
+    def reorden(i):
+        app.consultar_reorden.clear()
+        app.consultar_reorden(hoy, app.REORDEN_VENTANA_DIAS, app.REORDEN_COBERTURA_DIAS, app.REORDEN_PLAZO_DIAS,
+                              app.version_productos())
+    medir("reportes.reorden", reorden, max(3, repeticiones // 3))
+
+    def pagina_inventario(i):
+        app.consultar_inventario.clear()
+        app.consultar_inventario("Cuaderno" if i % 2 else "", False, 0.0, 0.0, "Nombre (A-Z)", i % 5, app.version_productos())
+    medir("inventario.pagina", pagina_inventario, max(3, repeticiones // 3))
+
+    for formato in app.FORMATOS_EXPORTACION:
+        def exportar(i, formato=formato):
+            with tempfile.TemporaryDirectory() as destino:
+                app.exportar_ventas(formato, destino, hoy - timedelta(days=30), hoy, None)
+        try:
+            medir(f"exportar.{formato}", exportar, 3)
+        except ImportError as e:
+            print(f"(se omite exportar.{formato}: {e})", file=sys.stderr)
+
+    return resultados
+
+# ==========================================
+# 4. LÍNEA BASE Y REGRESIONES
+# ==========================================
+def comparar(base, actual, tolerancia, piso_ms):
+    """Lista de regresiones: más lento que base*(1+tolerancia) y por más de piso_ms, o más llamadas a Sheets"""
+    regresiones = []
+    for skus, operaciones in actual.items():
+        for op, r in operaciones.items():
+            b = base.get(skus, {}).get(op)
+            if b is None:
+                continue
+            limite = b['mediana_ms'] * (1 + tolerancia)
+            if r['mediana_ms'] > limite and r['mediana_ms'] - b['mediana_ms'] > piso_ms:
+                regresiones.append(f"{skus} SKUs · {op}: {r['mediana_ms']} ms (base {b['mediana_ms']} ms)")
+            if r['llamadas_sheets'] > b['llamadas_sheets']:
+                regresiones.append(f"{skus} SKUs · {op}: {r['llamadas_sheets']} llamadas a Sheets "
+                                   f"(base {b['llamadas_sheets']})")
+    return regresiones
+
+def imprimir(resultados):
+    print(f"{'SKUs':>8}  {'operación':<22}{'n':>5}{'mediana ms':>13}{'p95 ms':>11}{'sheets/op':>11}")
+    for skus, operaciones in resultados.items():
+        for op, r in operaciones.items():
+            print(f"{skus:>8}  {op:<22}{r['n']:>5}{r['mediana_ms']:>13.3f}{r['p95_ms']:>11.3f}{r['llamadas_sheets']:>11}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--skus", default="1000,20000", help="tamaños de catálogo separados por coma (1k a 200k)")
+    parser.add_argument("--ventas", type=int, default=20000, help="tickets del historial sintético")
+    parser.add_argument("--latencia", type=float, default=0.05, help="segundos de espera por llamada a Sheets")
+    parser.add_argument("--repeticiones", type=int, default=30)
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="fracción de lentitud aceptada sobre la base")
+    parser.add_argument("--piso-ms", type=float, default=2.0, help="diferencias menores a esto no cuentan")
+    parser.add_argument("--base", default=ARCHIVO_BASE)
+    parser.add_argument("--guardar-base", action="store_true", help="sobrescribe la línea base con esta corrida")
+    parser.add_argument("--medir", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        # Proceso hijo: un solo tamaño, resultado en JSON por la salida estándar
+        print(json.dumps(medir_tamano(args.medir, args.ventas, args.latencia, args.repeticiones)))
+        return 0
+
+    parametros = {'ventas': args.ventas, 'latencia': args.latencia, 'repeticiones': args.repeticiones}
+    resultados = {}
+    for skus in (int(s) for s in args.skus.split(",")):
+        print(f"Midiendo {skus} SKUs...", file=sys.stderr)
+        salida = subprocess.run([sys.executable, os.path.abspath(__file__), "--medir", str(skus),
+                                 "--ventas", str(args.ventas), "--latencia", str(args.latencia),
+                                 "--repeticiones", str(args.repeticiones)],
+                                stdout=subprocess.PIPE, text=True, check=True)
+        resultados[str(skus)] = json.loads(salida.stdout.strip().splitlines()[-1])
+    imprimir(resultados)
+
+    if args.guardar_base or not os.path.exists(args.base):
+        with open(args.base, "w") as f:
+            json.dump({'parametros': parametros, 'resultados': resultados}, f, indent=1, ensure_ascii=False)
+        print(f"Línea base guardada en {args.base}")
+        return 0
+
+    with open(args.base) as f:
+        base = json.load(f)
+    if base['parametros'] != parametros:
+        print(f"La base se midió con {base['parametros']}; usa los mismos parámetros o --guardar-base")
+        return 2
+    regresiones = comparar(base['resultados'], resultados, args.tolerancia, args.piso_ms)
+    for r in regresiones:
+        print(f"REGRESIÓN {r}")
+    print("Sin regresiones." if not regresiones else f"{len(regresiones)} regresiones.")
+    return 1 if regresiones else 0
+
+if __name__ == "__main__":
+    sys.exit(main())